@@ -1,13 +1,100 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 import bcrypt
 
+USERS_FILE = "users.yaml"
+
+# bcrypt (cost 12, ~250ms) releases the GIL, so concurrent logins verify in
+# parallel on this pool; the pool bounds how many checks run at once.
+VERIFY_WORKERS = int(os.environ.get("LOGIN_VERIFY_WORKERS", "4"))
+
+def parse_users_yaml(path):
+    with open(path, "r") as f:
+        users = yaml.safe_load(f)["users"]
+    by_name = {}
+    for user in users:
+        by_name.setdefault(user["username"], user)
+    return by_name
+
+def parse_credentials_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+class CredentialStore:
+    """Users keyed by name, re-read only when the file's modification time changes.
+
+    Added or removed users are picked up on the next lookup without a restart.
+    A missing file means no users.
+    """
+
+    def __init__(self, path, parse):
+        self.path = path
+        self.parse = parse
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._users = {}
+
+    def users(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._users = self.parse(self.path) if mtime is not None else {}
+                self._mtime = mtime
+            return self._users
+
+    def get(self, username):
+        return self.users().get(username)
+
+    def invalidate(self):
+        with self._lock:
+            self._mtime = None
+
+user_store = CredentialStore(USERS_FILE, parse_users_yaml)
+
+_verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="bcrypt")
+_latencies = deque(maxlen=1000)
+
+def _checkpw(password, password_hash):
+    start = time.perf_counter()
+    try:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    finally:
+        _latencies.append(time.perf_counter() - start)
+
 def load_users():
-    with open("users.yaml", "r") as f:
-        return yaml.safe_load(f)["users"]
+    return list(user_store.users().values())
 
 def verify_user(username, password):
-    users = load_users()
-    for user in users:
-        if user["username"] == username and bcrypt.checkpw(password.encode(), user["password_hash"].encode()):
-            return user["role"]
+    """The user's role when the password matches, else None.
+
+    Synchronous: the caller waits for the bcrypt check (~250ms). Callers that
+    verify the same credentials repeatedly should cache the result.
+    """
+    user = user_store.get(username)
+    if user is None:
+        return None
+    if _verify_pool.submit(_checkpw, password, user["password_hash"]).result():
+        return user["role"]
     return None
+
+def verification_stats():
+    """Recent bcrypt verification latencies in milliseconds."""
+    samples = sorted(_latencies)
+    if not samples:
+        return {"count": 0}
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "max_ms": samples[-1] * 1000,
+    }
@@ -1,19 +1,21 @@
 
 import streamlit as st
+import copy
 import json
-from pathlib import Path
+from access_control_password import CredentialStore, parse_credentials_json
 
 CRED_FILE = "user_credentials.json"
 
+credential_store = CredentialStore(CRED_FILE, parse_credentials_json)
+
 def load_users():
-    if Path(CRED_FILE).exists():
-        with open(CRED_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    # Copy, since the UI edits the dict before saving it back
+    return copy.deepcopy(credential_store.users())
 
 def save_users(users):
     with open(CRED_FILE, "w") as f:
         json.dump(users, f, indent=4)
+    credential_store.invalidate()
 
 def user_management_ui():
     st.subheader("🔧 Manage Users")
@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
 from io import BytesIO
-from merge_csv_only import process_files
-from access_control_password import verify_user
-from validation_logic import style_dataframe
+from merge_csv_only import process_files, process_snapshot
+import snapshot_store
+import results_store
+import run_exports
+import run_delta
+import run_profiler
+from access_control_password import verify_user, verification_stats
+from parallel_validation import ShardedFrameValidator
 
 st.set_page_config(page_title="Excel & CSV files Merge Comparison Tool", layout="wide")
 
@@ -23,12 +28,20 @@ with st.sidebar:
     if st.session_state.get("authenticated", False):
         st.success(f"Logged in as: {st.session_state.get('username', 'Unknown')}")
         st.info(f"Role: {st.session_state.get('role', '[none]')}")
+        if st.session_state.get('role') == "admin":
+            stats = verification_stats()
+            if stats["count"]:
+                st.caption(
+                    f"Login checks: p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms "
+                    f"over the last {stats['count']}"
+                )
         if st.button("🚪 Logout"):
             st.session_state['authenticated'] = False
             st.session_state['role'] = None
             st.session_state['username'] = ""
-            st.session_state['merged_excel_bytes'] = None
-            st.session_state['merged_df'] = None
+            st.session_state['run_id'] = None
+            # Otherwise the next login in this browser reopens this user's run
+            st.query_params.pop("run", None)
             st.rerun()
     else:
         st.info("Please login to access the tool.")
@@ -74,74 +87,187 @@ csv_files = st.file_uploader(
 )
 
 # ---- MERGE LOGIC ----
+def load_merge_outputs(outputs, delta_mode=False, profiler=None):
+    if outputs and isinstance(outputs, dict):
+        st.success("✅ Merge complete! Download your files below:")
+        # Stored once for every session; this session only keeps the run id
+        run_id = results_store.save_outputs(outputs, meta={"username": username})
+        st.session_state["run_id"] = run_id
+        st.query_params["run"] = run_id
+        if delta_mode:
+            run = results_store.open_run(run_id)
+            previous = run_delta.previous_run(run)
+            summary = run_profiler.call(
+                profiler, run_delta.delta_validate, run, run.validator(ShardedFrameValidator), previous
+            )
+            if previous is None:
+                st.info("Δ No earlier run with fingerprints yet; everything was validated.")
+            else:
+                st.info(
+                    f"Δ Compared with run {previous.run_id}: {summary['revalidated_rows']} rows revalidated, "
+                    f"{summary['reused_rows']} reused."
+                )
+        if profiler is not None:
+            run = results_store.open_run(run_id)
+            with st.spinner("Profiling validation and exports..."):
+                run_profiler.profile_exports(profiler, run)
+            run_profiler.save_profile(profiler, run)
+        run_exports.schedule_exports(run_id)
+    else:
+        st.error("❌ Merge failed.")
+
 if role in ["operator", "admin"]:
     st.header("2️⃣ Merge and Compare")
+    save_snapshot = st.checkbox(
+        "💾 Save uploads to the local snapshot store",
+        help=f"Bulk-loads the files into {snapshot_store.STORE_PATH} so they can be re-validated later without re-uploading."
+    )
+    delta_mode = st.checkbox(
+        "Δ Delta mode: compare with the previous run",
+        help="Revalidates only rows that changed since the last stored run and lists what changed."
+    )
+    profile_run = role == "admin" and st.checkbox(
+        "🩺 Profile this run",
+        help="Runs the merge, validation and download exports under cProfile and stores the profile with the run."
+    )
     if st.button("🔄 Start Merge"):
         if excel_file and csv_files:
-            outputs = process_files(excel_file, csv_files)
-            if outputs and isinstance(outputs, dict):
-                st.success("✅ Merge complete! Download your files below:")
-                merged_excel_bytes = outputs["detailed"].getvalue()
-                st.session_state["merged_excel_bytes"] = merged_excel_bytes
-                merged_df = pd.read_excel(
-                    BytesIO(merged_excel_bytes), 
-                    sheet_name="Merged Data", 
-                    dtype=str, keep_default_na=False
-                )
-                merged_df = merged_df.fillna("")
-                st.session_state["merged_df"] = merged_df
-            else:
-                st.error("❌ Merge failed.")
+            store_path = snapshot_store.STORE_PATH if save_snapshot else None
+            profiler = run_profiler.new_profiler() if profile_run else None
+            outputs = run_profiler.call(profiler, process_files, excel_file, csv_files, store_path=store_path)
+            load_merge_outputs(outputs, delta_mode, profiler)
         else:
             st.warning("⚠️ Please upload all required files.")
 
+    snapshots = snapshot_store.list_snapshots()
+    if not snapshots.empty:
+        with st.expander("🗄️ Re-run a stored snapshot"):
+            st.dataframe(snapshots, use_container_width=True, hide_index=True)
+            snapshot_id = st.selectbox("Snapshot ID", snapshots["id"].tolist(), key="snapshot_id")
+            if st.button("🔁 Re-run Merge on Snapshot"):
+                profiler = run_profiler.new_profiler() if profile_run else None
+                outputs = run_profiler.call(profiler, process_snapshot, int(snapshot_id))
+                load_merge_outputs(outputs, delta_mode, profiler)
+            if st.button("🗑️ Delete Snapshot"):
+                snapshot_store.delete_snapshots([int(snapshot_id)])
+                st.rerun()
+
 elif role == "view":
     st.info("👁️ You have view-only access. Merge action is disabled.")
 
-merged_df = st.session_state.get("merged_df")
+stored_runs = results_store.list_runs()
+if stored_runs:
+    with st.expander("📂 Open a stored merge result"):
+        runs_table = pd.DataFrame(stored_runs).reindex(columns=["run_id", "created_at", "rows", "username"])
+        st.dataframe(runs_table, use_container_width=True, hide_index=True)
+        open_run_id = st.selectbox("Run ID", [run["run_id"] for run in stored_runs], key="open_run_id")
+        if st.button("📂 Open Run"):
+            st.session_state["run_id"] = open_run_id
+            st.query_params["run"] = open_run_id
+
+# A reconnecting session finds its run again through the URL
+if not st.session_state.get("run_id") and "run" in st.query_params:
+    st.session_state["run_id"] = st.query_params["run"]
 
-if merged_df is not None:
+run = None
+if st.session_state.get("run_id"):
+    try:
+        run = results_store.open_run(st.session_state["run_id"])
+    except results_store.RunNotFound:
+        st.warning(f"⚠️ Merge result {st.session_state['run_id']} is no longer stored. Please merge again.")
+        st.session_state["run_id"] = None
+        st.query_params.pop("run", None)
+
+if run is not None:
+    merged_df = run.df
+    # Shared by every session viewing this run, so per-column results survive reruns.
+    validator = run.validator(ShardedFrameValidator)
+    schema = validator.schema
     st.markdown("---")
     st.header("3️⃣ Download Options & Field Comparison")
 
+    # --- Unmatched rows, as listed in the Unmatched_* sheets ---
+    unmatched_counts = run.meta.get("unmatched")
+    if unmatched_counts:
+        metrics = [("Unmatched Excel rows", unmatched_counts["excel"])] + [
+            (f"Unmatched {label} CSV rows", count) for label, count in unmatched_counts["csv"].items()
+        ]
+        for metric_col, (title, count) in zip(st.columns(len(metrics)), metrics):
+            metric_col.metric(title, count)
+
     # --- UI Column Filtering ---
     ui_cols = [col for col in merged_df.columns if not hide_col(col)]
 
     # --- Download buttons ---
-    col_dl1, col_dl2, col_dl3 = st.columns(3)
-    with col_dl1:
-        st.download_button(
-            "📥 Download Merged Output (raw, all columns)",
-            data=st.session_state["merged_excel_bytes"],
-            file_name="merged_output.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    with col_dl2:
-        styled_validated = style_dataframe(merged_df)
-        output_validated = BytesIO()
-        with pd.ExcelWriter(output_validated, engine="openpyxl") as writer:
-            styled_validated.to_excel(writer, index=False, sheet_name="StyledData")
-        output_validated.seek(0)
-        st.download_button(
-            "📥 Download Validated Output (all columns, with colors)",
-            data=output_validated,
-            file_name="validated_output.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    run_exports.schedule_exports(run.run_id)
+    export_labels = {
+        "validated_xlsx": "📥 Download Validated Output (all columns, with colors)",
+        "csv": "📥 Download Merged Output (CSV)",
+        "parquet": "📥 Download Merged Output (Parquet)",
+        "sheets_zip": "📥 Download All Sheets (zip of CSVs, incl. Unmatched)",
+    }
+
+    def read_file(path):
+        # Deferred: the file is only read when the button is clicked
+        def read():
+            with open(path, "rb") as f:
+                return f.read()
+        return read
+
+    export_status = run_exports.export_status(run)
 
-    tabs = st.tabs(["Merged Data", "Field Comparison Viewer"])
+    # Re-checks every few seconds until the background exports are done
+    @st.fragment(run_every=2 if "pending" in export_status.values() else None)
+    def download_buttons():
+        status = run_exports.export_status(run)
+        errors = run_exports.export_errors(run)
+        col_dl = st.columns(len(export_labels) + 1)
+        with col_dl[0]:
+            st.download_button(
+                "📥 Download Merged Output (raw, all columns)",
+                data=read_file(run.file_path(results_store.MERGED_XLSX)),
+                file_name="merged_output.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        for col, (name, label) in zip(col_dl[1:], export_labels.items()):
+            _, file_name, mime, _ = run_exports.EXPORTS[name]
+            with col:
+                if status[name] == "ready":
+                    st.download_button(
+                        label, data=read_file(run_exports.export_path(run, name)), file_name=file_name, mime=mime
+                    )
+                elif status[name] == "failed":
+                    st.button(f"{label} — failed", disabled=True, key=f"export_{name}", help=errors.get(name))
+                else:
+                    st.button(f"{label} — preparing…", disabled=True, key=f"export_{name}")
+        if "pending" not in status.values() and "pending" in export_status.values():
+            # Drop the polling once every export is ready or has failed
+            st.rerun()
+
+    download_buttons()
+
+    changes, delta_summary = run_delta.load_changes(run)
+    tab_names = ["Merged Data", "Field Comparison Viewer"]
+    if changes is not None:
+        tab_names.append("Changed Since Last Run")
+    tabs = st.tabs(tab_names)
 
     # --- Tab 1: Merged Data (UI, hidden columns) ---
     with tabs[0]:
-        styled_ui = style_dataframe(merged_df[ui_cols])
+        styled_ui = validator.style(ui_cols)
         st.dataframe(styled_ui, use_container_width=True, height=600)
 
     # --- Tab 2: Field Comparison (hidden columns) ---
     with tabs[1]:
         st.header("🔍 Field Comparison Viewer")
-        excel_cols = [col for col in ui_cols if "_" not in col and col.lower() != "index" and col != "OVERRIDE ID"]
-        csv_cols = [col for col in ui_cols if "_" in col]
-        csv_field_names = sorted(set(col.rsplit("_", 1)[0] for col in csv_cols), key=str.lower)
+        excel_cols = [
+            col for col in schema.excel_columns
+            if col in ui_cols and col.lower() != "index" and col != "OVERRIDE ID"
+        ]
+        csv_field_names = [
+            base for base in schema.field_bases()
+            if any(col in ui_cols for col in schema.base_to_cols[base])
+        ]
 
         col1, col2 = st.columns(2)
         with col1:
@@ -149,7 +275,7 @@ if merged_df is not None:
         with col2:
             sel_csv_field = st.selectbox("Select CSV Field Name", csv_field_names, key="csv_field_name")
 
-        selected_csv_cols = [col for col in csv_cols if col.lower().startswith(sel_csv_field.lower() + "_")]
+        selected_csv_cols = [col for col in schema.base_to_cols.get(sel_csv_field, []) if col in ui_cols]
         compare_cols = (
             (["OVERRIDE ID"] if "OVERRIDE ID" in ui_cols else []) +
             [sel_excel_col] + selected_csv_cols
@@ -159,18 +285,61 @@ if merged_df is not None:
         if not selected_csv_cols:
             st.warning(f"No columns found for CSV field '{sel_csv_field}'. Check your merge or column names.")
         else:
-            subset_df = merged_df[compare_cols]
-            styled_subset = style_dataframe(subset_df)
+            styled_subset = validator.style(compare_cols)
             st.dataframe(styled_subset, use_container_width=True, height=600)
 
-            # --- Download comparison fields (with colors) ---
-            output_compare = BytesIO()
-            with pd.ExcelWriter(output_compare, engine="openpyxl") as writer:
-                styled_subset.to_excel(writer, index=False, sheet_name="FieldComparison")
-            output_compare.seek(0)
+            # --- Download comparison fields (with colors), encoded only when clicked ---
+            def comparison_xlsx():
+                output_compare = BytesIO()
+                with pd.ExcelWriter(output_compare, engine="openpyxl") as writer:
+                    styled_subset.to_excel(writer, index=False, sheet_name="FieldComparison")
+                return output_compare.getvalue()
+
             st.download_button(
                 "📥 Download Selected Fields (Field Comparison, with colors)",
-                data=output_compare,
+                data=comparison_xlsx,
                 file_name="selected_fields.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
+
+    # --- Tab 3: Changes since the previous run (delta mode only) ---
+    if changes is not None:
+        with tabs[2]:
+            st.header("Δ Changed Since Last Run")
+            counts = ", ".join(f"{delta_summary.get(change, 0)} {change}" for change in ("added", "changed", "removed"))
+            st.caption(f"Compared with run {delta_summary['previous_run_id']}: {counts}.")
+            st.dataframe(changes, use_container_width=True, height=600, hide_index=True)
+
+            def changes_xlsx():
+                output_changes = BytesIO()
+                with pd.ExcelWriter(output_changes, engine="openpyxl") as writer:
+                    changes.to_excel(writer, index=False, sheet_name="Changed Since Last Run")
+                return output_changes.getvalue()
+
+            st.download_button(
+                "📥 Download Changes (xlsx)",
+                data=changes_xlsx,
+                file_name="changed_since_last_run.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+    # --- Profile of this run (admins only) ---
+    hotspots = run_profiler.load_hotspots(run) if role == "admin" else None
+    if hotspots is not None:
+        with st.expander("🩺 Run Profile (hot spots by self time)"):
+            st.dataframe(hotspots.head(50), use_container_width=True, hide_index=True)
+            col_prof1, col_prof2 = st.columns(2)
+            with col_prof1:
+                st.download_button(
+                    "📥 Download Hot Spots (CSV)",
+                    data=read_file(run.file_path(run_profiler.HOTSPOTS_CSV)),
+                    file_name=f"hotspots_{run.run_id}.csv",
+                    mime="text/csv"
+                )
+            with col_prof2:
+                st.download_button(
+                    "📥 Download Profile (.prof, for pstats/snakeviz)",
+                    data=read_file(run.file_path(run_profiler.PROFILE_FILE)),
+                    file_name=f"profile_{run.run_id}.prof",
+                    mime="application/octet-stream"
+                )
@@ -0,0 +1,240 @@
+"""Micro-benchmarks for the merge and validation hot paths.
+
+Run one with e.g. ``python benchmarks.py rules --rows 5000``. Inputs are
+synthetic and generated in memory, so no production files are needed.
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+from io import BytesIO
+import pandas as pd
+from openpyxl import Workbook
+import xlsx_reader
+from validation_logic import (
+    EXCEL_FIELDS, HDR_TX_TYPES, SDR_TX_TYPES,
+    find_duplicate_rows, build_csv_inconsistent_cells, validate_cell, validate_frame,
+)
+from column_schema import ColumnSchema
+from validation_logic import FrameValidator
+from parallel_validation import validate_frame_parallel
+
+CSV_FIELDS = [
+    "clientContentId", "performChannel", "day", "originalTier", "tier", "heEventTypeName",
+    "policies", "drmRequired", "variants", "watermarking", "heResilience", "description",
+]
+
+def synthetic_merged_frame(rows, labels=("events", "live_events"), seed=0):
+    """A merged sheet shaped like process_files output, with every rule exercised."""
+    rng = random.Random(seed)
+    tx_types = HDR_TX_TYPES + SDR_TX_TYPES + ["Other"]
+    override_ids = ["1601", "1655", "1685", "2650", "4601", "1501", "2599", "7777", "9999", "x", ""]
+    data = {col: [] for col in EXCEL_FIELDS}
+    for label in labels:
+        for field in CSV_FIELDS:
+            data[f"{field}_{label}"] = []
+        data[f"match_type_{label}"] = []
+    for i in range(rows):
+        override_id = rng.choice(override_ids)
+        mfl_id = str(100000 + i)
+        pre_ko = f"2024-05-{1 + i % 28:02d} 1{i % 10}:00:00"
+        excel_row = {
+            "DATE TIME PRE KO (UTC)": pre_ko, "KO (UTC)": "12:00", "REGION": "EU", "SPORT": "Football",
+            "PROPERTY": "P", "FIXTURE": f"A v B {i}", "BROADCAST TIER": rng.choice(["Tier 1", "Tier 2", ""]),
+            "SUPPORT TIER": "S", "TX TYPE": rng.choice(tx_types), "OVERRIDE ID": override_id, "MFL ID": mfl_id,
+            "HEVC": rng.choice(["HEVC", ""]), "CLOSED CAPTIONS": rng.choice(["US English", "US Spanish", "None"]),
+            "MULTI-TRACK AUDIO": rng.choice(["No", "Yes"]), "AUDIO LANG": rng.choice(["EN 5.1", "EN 2.0"]),
+            "OTHER INFO (MULTIVIEW)": "",
+        }
+        for col, val in excel_row.items():
+            data[col].append(val)
+        for label in labels:
+            csv_row = {
+                "clientContentId": mfl_id if rng.random() > 0.1 else "999",
+                "performChannel": override_id if rng.random() > 0.1 else "1111",
+                "day": pre_ko[:10] if rng.random() > 0.1 else "2020-01-01",
+                "originalTier": rng.choice(["1", "2"]), "tier": "1",
+                "heEventTypeName": rng.choice(["hevc_hdr10_5994_x", "avc_5994_freemium"]),
+                "policies": rng.choice(["captions708,dolby", "captions708", ""]),
+                "drmRequired": rng.choice(["false", "true"]), "variants": "English Single",
+                "watermarking": "NO_WATERMARKING", "heResilience": rng.choice(["MAC", ""]), "description": "d",
+            }
+            for field, val in csv_row.items():
+                data[f"{field}_{label}"].append(val)
+            data[f"match_type_{label}"].append(rng.choice(["full+invalid", "partial+invalid", "none"]))
+    return pd.DataFrame(data)
+
+def best_of(repeat, func):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def report(title, rows):
+    print(title)
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f"  {name:<{width}}  {value}")
+
+def bench_rules(rows, repeat):
+    """Compiled rule evaluation (validate_frame) vs the hand-written per-cell validate_cell path."""
+    # validate_cell matches labels by suffix, which is only unambiguous without underscores
+    df = synthetic_merged_frame(rows, labels=("events", "live"))
+    schema = ColumnSchema.infer(df.columns)
+    dynamic_suffixes = set(schema.labels)
+    duplicate_rows = find_duplicate_rows(df)
+    csv_inconsistent_cells = build_csv_inconsistent_cells(df, schema.base_to_cols)
+
+    def hand_written():
+        statuses = {col: [] for col in df.columns}
+        for row_idx, row in df.iterrows():
+            for col in df.columns:
+                statuses[col].append(validate_cell(
+                    col, row.get(col, ""), row, row_idx, csv_inconsistent_cells, duplicate_rows, dynamic_suffixes
+                ))
+        return statuses
+
+    def compiled():
+        return validate_frame(df, csv_inconsistent_cells, duplicate_rows, schema)
+
+    hand_time, expected = best_of(repeat, hand_written)
+    compiled_time, actual = best_of(repeat, compiled)
+    if actual != expected:
+        raise AssertionError("compiled rules disagree with validate_cell")
+    cells = rows * len(df.columns)
+    report(f"Rule evaluation, {rows} rows x {len(df.columns)} columns (best of {repeat})", [
+        ("validate_cell per cell", f"{hand_time:.3f}s ({cells / hand_time:,.0f} cells/s)"),
+        ("compiled validate_frame", f"{compiled_time:.3f}s ({cells / compiled_time:,.0f} cells/s)"),
+        ("speed-up", f"{hand_time / compiled_time:.1f}x"),
+    ])
+
+def synthetic_powerbi_xlsx(rows, extra_columns=20, seed=0):
+    """An xlsx export with EXCEL_FIELDS plus unused columns, as PowerBI produces."""
+    df = synthetic_merged_frame(rows, labels=(), seed=seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Export")
+    ws.append(list(df.columns) + [f"Unused {i}" for i in range(extra_columns)])
+    filler = [f"value {i}" for i in range(extra_columns)]
+    for row in df.itertuples(index=False):
+        ws.append(list(row) + filler)
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def bench_excel_load(rows, repeat):
+    """pd.read_excel(dtype=str) vs the streaming/column-projected xlsx_reader.read_xlsx."""
+    data = synthetic_powerbi_xlsx(rows)
+    runs = [
+        ("pd.read_excel(dtype=str), openpyxl", lambda: pd.read_excel(BytesIO(data), dtype=str)),
+        ("read_xlsx, openpyxl read-only", lambda: xlsx_reader._read_openpyxl_streaming(BytesIO(data), set(EXCEL_FIELDS))),
+    ]
+    if xlsx_reader.python_calamine is not None:
+        runs.append(("read_xlsx, calamine", lambda: xlsx_reader._read_calamine(BytesIO(data), set(EXCEL_FIELDS))))
+
+    results = []
+    baseline = None
+    for name, func in runs:
+        best_time, best_peak, df = None, None, None
+        for _ in range(repeat):
+            elapsed, peak, df = measure(func)
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+            best_peak = peak if best_peak is None else min(best_peak, peak)
+        if baseline is None:
+            baseline = df[EXCEL_FIELDS]
+        elif not df.equals(baseline):
+            raise AssertionError(f"{name} differs from pd.read_excel")
+        results.append((name, f"{best_time:.3f}s, peak {best_peak / 2**20:.1f} MiB"))
+    report(f"Excel load, {rows} rows x {len(EXCEL_FIELDS) + 20} columns (best of {repeat})", results)
+
+def bench_parallel(rows, repeat):
+    """Sharded multi-process validation at 1..N workers (N = CPU count)."""
+    df = synthetic_merged_frame(rows)
+    serial = FrameValidator(df)
+    columns = list(df.columns)
+    counts = [1]
+    while counts[-1] * 2 <= max(os.cpu_count() or 1, 2):
+        counts.append(counts[-1] * 2)
+
+    expected = serial.statuses()
+    results = []
+    baseline = None
+    # Every count runs the same sharded path, so only the number of workers changes
+    for workers in counts:
+        # Warm the pool so process start-up is not counted
+        validate_frame_parallel(df.iloc[:workers], serial.schema, columns, [], workers)
+        elapsed, actual = best_of(repeat, lambda: validate_frame_parallel(
+            df, serial.schema, columns, serial._duplicate_positions, workers
+        ))
+        if actual != expected:
+            raise AssertionError(f"{workers} workers disagree with in-process validation")
+        baseline = baseline or elapsed
+        label = "1 worker" if workers == 1 else f"{workers} workers"
+        results.append((label, f"{elapsed:.3f}s ({baseline / elapsed:.1f}x)"))
+    report(f"Validation, {rows} rows x {len(columns)} columns, {os.cpu_count()} CPUs (best of {repeat})", results)
+
+def bench_delta(rows, repeat, changed_share=0.05):
+    """Delta validation of a re-run with a few changed rows vs validating everything again."""
+    import tempfile
+    import results_store
+    import run_delta
+
+    first = synthetic_merged_frame(rows)
+    second = first.copy()
+    rng = random.Random(1)
+    for pos in rng.sample(range(rows), int(rows * changed_share)):
+        second.iat[pos, second.columns.get_loc("tier_events")] = rng.choice(["1", "2", "3"])
+        second.iat[pos, second.columns.get_loc("AUDIO LANG")] = rng.choice(["EN 5.1", "EN 2.0"])
+    schema = ColumnSchema.infer(first.columns)
+    with tempfile.TemporaryDirectory() as results_dir:
+        previous = results_store.open_run(results_store.save_run(first, b"", schema, results_dir=results_dir), results_dir)
+        run_delta.ensure_fingerprints(previous, previous.validator())
+        run = results_store.open_run(results_store.save_run(second, b"", schema, results_dir=results_dir), results_dir)
+
+        full_time, expected = best_of(repeat, lambda: FrameValidator(run.df, run.schema).statuses())
+
+        def delta():
+            validator = FrameValidator(run.df, run.schema)
+            summary = run_delta.delta_validate(run, validator, previous)
+            return summary, validator.statuses()
+
+        delta_time, (summary, actual) = best_of(repeat, delta)
+        if actual != expected:
+            raise AssertionError("delta validation disagrees with full validation")
+    report(f"Re-run validation, {rows} rows x {len(first.columns)} columns (best of {repeat})", [
+        ("full validation", f"{full_time:.3f}s"),
+        ("delta validation", f"{delta_time:.3f}s ({full_time / delta_time:.1f}x)"),
+        ("rows revalidated", f"{summary['revalidated_rows']} of {rows}"),
+        ("rows changed", f"{summary.get('changed', 0)}"),
+    ])
+
+BENCHMARKS = {
+    "rules": bench_rules,
+    "excel-load": bench_excel_load,
+    "parallel": bench_parallel,
+    "delta": bench_delta,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.rows, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from collections import namedtuple, defaultdict
+
+# source: "excel" or "csv"; base: field name without the label suffix;
+# label: CSV file label (None for Excel); role: "field", "match_type" or "mismatch_key".
+ColumnInfo = namedtuple("ColumnInfo", ["source", "base", "label", "role"])
+
+MATCH_COLUMN_ROLES = ("match_type", "mismatch_key")
+
+class ColumnSchema:
+    """Role of every merged column, resolved once per merge.
+
+    CSV columns are named ``<base>_<label>``; labels are matched exactly
+    (longest first), so labels and Excel headers that contain underscores
+    are classified correctly.
+    """
+
+    def __init__(self, columns, excel_columns, labels):
+        self.labels = list(labels)
+        excel_columns = set(excel_columns)
+        by_length = sorted(self.labels, key=len, reverse=True)
+        self.columns = {}
+        for col in columns:
+            self.columns[col] = self._classify(col, excel_columns, by_length)
+
+        self.excel_columns = [col for col, info in self.columns.items() if info.source == "excel"]
+        self.csv_columns = [col for col, info in self.columns.items() if info.source == "csv"]
+        self.base_to_cols = defaultdict(list)
+        self.label_to_cols = defaultdict(list)
+        for col in self.csv_columns:
+            info = self.columns[col]
+            self.base_to_cols[info.base].append(col)
+            self.label_to_cols[info.label].append(col)
+
+    @staticmethod
+    def _classify(col, excel_columns, labels_by_length):
+        if col not in excel_columns:
+            for label in labels_by_length:
+                if col.endswith(f"_{label}"):
+                    base = col[:-(len(label)+1)]
+                    role = base if base in MATCH_COLUMN_ROLES else "field"
+                    return ColumnInfo("csv", base, label, role)
+        return ColumnInfo("excel", col, None, "field")
+
+    @classmethod
+    def infer(cls, columns):
+        """Schema for a merged sheet read back from disk: labels come from its match_type columns.
+
+        Without any match_type column, falls back to the text after the last underscore.
+        """
+        labels = [col[len("match_type_"):] for col in columns if col.startswith("match_type_")]
+        if not labels:
+            labels = sorted({col.rsplit("_", 1)[1] for col in columns if "_" in col})
+        return cls(columns, [], labels)
+
+    def info(self, col):
+        return self.columns.get(col)
+
+    def base_of(self, col):
+        return self.columns[col].base
+
+    def label_of(self, col):
+        return self.columns[col].label
+
+    def is_csv(self, col):
+        info = self.columns.get(col)
+        return info is not None and info.source == "csv"
+
+    def match_type_col(self, label):
+        return f"match_type_{label}"
+
+    def mismatch_key_col(self, label):
+        return f"mismatch_key_{label}"
+
+    def field_bases(self):
+        """CSV base field names, as offered in the Field Comparison Viewer."""
+        return sorted(self.base_to_cols, key=str.lower)
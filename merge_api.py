@@ -0,0 +1,340 @@
+"""Local HTTP API for running merges from other tools.
+
+Start it with ``python merge_api.py --port 8502``. Requests authenticate with
+HTTP Basic auth against users.yaml, like the Streamlit login.
+
+    POST /jobs                         multipart: excel, csv (repeatable), json (repeatable, legacy),
+                                       engine=csv_only|legacy -> 202 {"job_id", ...}, 503 when the queue is full
+    GET  /jobs/<job_id>                status, queue position and timings; run_id and downloads when done
+    GET  /jobs/<job_id>/download       merged xlsx
+    GET  /jobs/<job_id>/download/<fmt> validated_xlsx, csv, parquet or sheets_zip (409 while being built)
+    GET  /health                       queue and worker counts, no auth
+"""
+import os
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+import email.policy
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import results_store
+import run_exports
+from access_control_password import user_store, verify_user
+
+# Merges running at once, each in its own process.
+MERGE_API_WORKERS = int(os.environ.get("MERGE_API_WORKERS", "2"))
+# Jobs allowed to wait for a worker; further submissions get 503 until one finishes.
+MERGE_API_QUEUE_SIZE = int(os.environ.get("MERGE_API_QUEUE_SIZE", "8"))
+MAX_UPLOAD_BYTES = int(os.environ.get("MERGE_API_MAX_UPLOAD_BYTES", str(200 * 1024 ** 2)))
+# Finished jobs remembered for status requests; their results stay in the run store.
+JOB_HISTORY = 500
+
+# Successful logins are remembered this long, so polling clients skip the ~250ms bcrypt check.
+AUTH_CACHE_SECONDS = float(os.environ.get("MERGE_API_AUTH_CACHE_SECONDS", "60"))
+
+MERGE_ROLES = ("operator", "admin")
+ENGINES = ("csv_only", "legacy")
+
+class NamedUpload(BytesIO):
+    """An uploaded file as process_files expects it: file-like, with a ``name``."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+def _run_merge(engine, excel, csvs, jsons, username):
+    # Runs in a worker process; everything it produces goes to the run store
+    excel_file = NamedUpload(*excel)
+    csv_files = [NamedUpload(*upload) for upload in csvs]
+    if engine == "legacy":
+        import merge_logic
+        outputs = merge_logic.process_files(excel_file, csv_files, [NamedUpload(*upload) for upload in jsons])
+    else:
+        import merge_csv_only
+        outputs = merge_csv_only.process_files(excel_file, csv_files)
+    if not outputs:
+        raise RuntimeError("merge failed, see the service log")
+    return results_store.save_outputs(outputs, meta={"username": username, "engine": engine})
+
+# Per-process key, so cached entries never hold anything derivable from the password alone
+_auth_key = os.urandom(32)
+_auth_cache = {}
+_auth_lock = threading.Lock()
+
+def cached_verify_user(username, password):
+    """verify_user, with successful checks cached for AUTH_CACHE_SECONDS.
+
+    An entry only counts while the user's stored password hash is unchanged,
+    so password changes and removed users take effect immediately.
+    """
+    user = user_store.get(username)
+    if user is None:
+        return None
+    key = hmac.new(_auth_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+    now = time.monotonic()
+    with _auth_lock:
+        entry = _auth_cache.get(key)
+    if entry and entry[0] > now and entry[1] == user["password_hash"] and entry[2] == user["role"]:
+        return entry[2]
+    role = verify_user(username, password)
+    with _auth_lock:
+        if role is None:
+            _auth_cache.pop(key, None)
+        else:
+            _auth_cache[key] = (now + AUTH_CACHE_SECONDS, user["password_hash"], role)
+        for stale in [k for k, (expires, _, _) in _auth_cache.items() if expires <= now]:
+            del _auth_cache[stale]
+    return role
+
+class Job:
+    def __init__(self, engine, username, uploads):
+        self.job_id = uuid.uuid4().hex
+        self.engine = engine
+        self.username = username
+        self.uploads = uploads  # (excel, csvs, jsons), released once the job starts
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.run_id = None
+        self.error = None
+
+class JobQueue:
+    """Bounded merge queue drained by one dispatcher thread per worker process.
+
+    Jobs only reach the process pool when a worker is free, so "running"
+    means running; when ``queue_size`` jobs are already waiting, submit refuses.
+    """
+
+    def __init__(self, workers=MERGE_API_WORKERS, queue_size=MERGE_API_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        # spawn: each worker starts clean instead of forking the threaded server
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._dispatch, name=f"merge-dispatch-{i}", daemon=True).start()
+
+    def submit(self, engine, excel, csvs, jsons, username):
+        """The new Job, or None when the queue is full."""
+        job = Job(engine, username, (excel, csvs, jsons))
+        with self.lock:
+            try:
+                self.pending.put_nowait(job)
+            except queue.Full:
+                return None
+            self.jobs[job.job_id] = job
+            finished = [job_id for job_id, old in self.jobs.items() if old.status in ("done", "failed")]
+            for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[job_id]
+        return job
+
+    def _dispatch(self):
+        while True:
+            job = self.pending.get()
+            excel, csvs, jsons = job.uploads
+            job.uploads = None
+            job.started_at = time.time()
+            job.status = "running"
+            try:
+                job.run_id = self.pool.submit(_run_merge, job.engine, excel, csvs, jsons, job.username).result()
+                job.status = "done"
+                run_exports.schedule_exports(job.run_id)
+            except Exception as e:
+                print("Error in merge job:", e)
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def describe(self, job):
+        with self.lock:
+            queued = [other.job_id for other in self.jobs.values() if other.status == "queued"]
+        info = {
+            "job_id": job.job_id,
+            "engine": job.engine,
+            "username": job.username,
+            "status": job.status,
+            "submitted_at": job.submitted_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+        if job.job_id in queued:
+            info["queue_position"] = queued.index(job.job_id) + 1
+        if job.started_at:
+            info["seconds"] = round((job.finished_at or time.time()) - job.started_at, 3)
+        if job.error:
+            info["error"] = job.error
+        if job.run_id:
+            info["run_id"] = job.run_id
+            try:
+                run = results_store.open_run(job.run_id)
+                info["unmatched"] = run.meta.get("unmatched")
+                info["downloads"] = {"merged": "ready", **run_exports.export_status(run)}
+                errors = run_exports.export_errors(run)
+                if errors:
+                    info["download_errors"] = errors
+            except results_store.RunNotFound:
+                info["downloads"] = {}
+        return info
+
+    def counts(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "running": statuses.count("running"),
+            "queued": statuses.count("queued"),
+        }
+
+def parse_multipart(content_type, body):
+    """Form fields and uploads (``{name: [(filename, bytes)]}``) of a multipart/form-data body."""
+    message = BytesParser(policy=email.policy.default).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    if not message.is_multipart():
+        raise ValueError("expected multipart/form-data")
+    fields, files = {}, defaultdict(list)
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename():
+            files[name].append((part.get_filename(), payload))
+        else:
+            fields[name] = payload.decode()
+    return fields, files
+
+class MergeAPIHandler(BaseHTTPRequestHandler):
+    jobs = None  # JobQueue, set by serve()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, indent=4).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path, file_name, mime):
+        self.send_response(200)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{file_name}"')
+        self.end_headers()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                self.wfile.write(chunk)
+
+    def _authenticate(self, roles=None):
+        """(username, role) for valid Basic credentials with an allowed role; otherwise replies and returns None."""
+        header = self.headers.get("Authorization", "")
+        username = password = None
+        if header.startswith("Basic "):
+            try:
+                username, _, password = base64.b64decode(header[6:]).decode().partition(":")
+            except ValueError:
+                pass
+        role = cached_verify_user(username, password) if username else None
+        if role is None:
+            self._send_json(401, {"error": "invalid username or password"}, {"WWW-Authenticate": 'Basic realm="merge"'})
+            return None
+        if roles and role not in roles:
+            self._send_json(403, {"error": f"role '{role}' may not run merges"})
+            return None
+        return username, role
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["health"]:
+            return self._send_json(200, self.jobs.counts())
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "not found"})
+        if self._authenticate() is None:
+            return
+        job = self.jobs.get(parts[1])
+        if job is None:
+            return self._send_json(404, {"error": "unknown job"})
+        if len(parts) == 2:
+            return self._send_json(200, self.jobs.describe(job))
+        if parts[2] != "download" or len(parts) > 4:
+            return self._send_json(404, {"error": "not found"})
+        if job.status != "done":
+            return self._send_json(409, {"error": f"job is {job.status}"})
+        try:
+            run = results_store.open_run(job.run_id)
+        except results_store.RunNotFound:
+            return self._send_json(410, {"error": "result was evicted from the run store"})
+        if len(parts) == 3:
+            return self._send_file(run.file_path(results_store.MERGED_XLSX), "merged_output.xlsx", run_exports.XLSX_MIME)
+        name = parts[3]
+        if name not in run_exports.EXPORTS:
+            return self._send_json(404, {"error": f"unknown format, use one of {sorted(run_exports.EXPORTS)}"})
+        status = run_exports.export_status(run)[name]
+        if status != "ready":
+            return self._send_json(409, {"error": f"{name} is {status}"}, {"Retry-After": "2"})
+        _, file_name, mime, _ = run_exports.EXPORTS[name]
+        return self._send_file(run_exports.export_path(run, name), file_name, mime)
+
+    def do_POST(self):
+        if self.path.split("?")[0].rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "not found"})
+        user = self._authenticate(MERGE_ROLES)
+        if user is None:
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_BYTES:
+            return self._send_json(413, {"error": f"uploads are limited to {MAX_UPLOAD_BYTES} bytes"})
+        try:
+            fields, files = parse_multipart(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+        engine = fields.get("engine", "csv_only")
+        if engine not in ENGINES:
+            return self._send_json(400, {"error": f"engine must be one of {list(ENGINES)}"})
+        if len(files.get("excel", [])) != 1 or not files.get("csv"):
+            return self._send_json(400, {"error": "upload one 'excel' file and at least one 'csv' file"})
+        job = self.jobs.submit(engine, files["excel"][0], files["csv"], files.get("json", []), user[0])
+        if job is None:
+            return self._send_json(503, {"error": "merge queue is full, retry later", **self.jobs.counts()}, {"Retry-After": "5"})
+        self._send_json(202, {"job_id": job.job_id, "status": job.status, "status_url": f"/jobs/{job.job_id}"})
+
+def serve(host="127.0.0.1", port=8502, workers=MERGE_API_WORKERS, queue_size=MERGE_API_QUEUE_SIZE):
+    MergeAPIHandler.jobs = JobQueue(workers, queue_size)
+    server = ThreadingHTTPServer((host, port), MergeAPIHandler)
+    print(f"Merge API listening on http://{host}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        MergeAPIHandler.jobs.pool.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=MERGE_API_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=MERGE_API_QUEUE_SIZE)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.queue_size)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
+import re
 import pandas as pd
 from io import BytesIO
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 from openpyxl.utils.dataframe import dataframe_to_rows
 from collections import defaultdict
-from validation_logic import style_dataframe, safe_str, EXCEL_FIELDS
+from validation_logic import validate_frame, EXCEL_FIELDS
+from xlsx_reader import read_xlsx
+from column_schema import ColumnSchema
+import snapshot_store
 
 red_fill = PatternFill(start_color="FFFF6666", end_color="FFFF6666", fill_type="solid")
 yellow_fill = PatternFill(start_color="FFFFFF00", end_color="FFFFFF00", fill_type="solid")
 orange_fill = PatternFill(start_color="FFFF9900", end_color="FFFF9900", fill_type="solid")
 
+# PowerBI columns carried into the merge besides EXCEL_FIELDS; everything else is never loaded.
+EXCEL_EXTRA_FIELDS = []
+
 def clean_override_id(val):
     try:
         f = float(val)
@@ -18,217 +26,272 @@ def clean_override_id(val):
     except Exception:
         return str(val).strip()
 
-def get_dynamic_suffixes(df):
-    suffixes = set()
-    for col in df.columns:
-        if '_' in col:
-            _, suffix = col.rsplit('_', 1)
-            suffixes.add(suffix)
-    return suffixes
-
-def get_excel_and_csv_cols_for_suffix(df, suffix):
-    excel_cols = [col for col in EXCEL_FIELDS if col in df.columns]
-    csv_cols = [col for col in df.columns if col.endswith(f"_{suffix}")]
-    return excel_cols, csv_cols
-
-def run_validation_for_row(row, excel_cols, csv_cols, validate_cell_func, row_idx):
-    all_valid = True
-    for col in excel_cols + csv_cols:
-        val = safe_str(row.get(col, ""))
-        valid = validate_cell_func(col, val, row, row_idx)
-        if valid is not True and valid != "csvgreen":
-            all_valid = False
-            break
+# Excel's limit for sheet names, and the characters it rejects in them
+SHEET_TITLE_MAX = 31
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+def unique_sheet_title(title, taken):
+    """``title`` made valid for Excel and unique (case-insensitively) among ``taken``, which it joins."""
+    title = INVALID_SHEET_CHARS.sub("_", title)
+    candidate = title[:SHEET_TITLE_MAX]
+    n = 2
+    while candidate.lower() in taken:
+        suffix = f"~{n}"
+        candidate = title[:SHEET_TITLE_MAX - len(suffix)] + suffix
+        n += 1
+    taken.add(candidate.lower())
+    return candidate
+
+def append_frame(ws, df):
+    # Rows go straight to the write-only sheet; nothing is kept per row
+    for r in dataframe_to_rows(df, index=False, header=True):
+        ws.append(r)
+
+def rows_all_valid(statuses, cols, row_count):
+    all_valid = [True] * row_count
+    for col in cols:
+        for i, valid in enumerate(statuses[col]):
+            if valid is not True and valid != "csvgreen":
+                all_valid[i] = False
     return all_valid
 
-def process_files(excel_file, csv_files):
+def read_excel_frame(excel_file, columns=EXCEL_FIELDS + EXCEL_EXTRA_FIELDS):
+    excel_df = read_xlsx(excel_file, columns)
+    excel_df["MFL ID"] = excel_df["MFL ID"].apply(clean_override_id)
+    excel_df["OVERRIDE ID"] = excel_df["OVERRIDE ID"].apply(clean_override_id)
+    return excel_df
+
+def read_csv_frames(csv_files):
+    csv_data = {}
+    for csv_file in csv_files:
+        label = csv_file.name.split('.')[0]
+        df = pd.read_csv(csv_file, dtype=str)
+        df["clientContentId"] = df["clientContentId"].apply(clean_override_id)
+        df["performChannel"] = df["performChannel"].apply(clean_override_id)
+        csv_data[label] = df
+    return csv_data
+
+def match_csv_rows(excel_df, label, df):
+    """Returns {excel_idx: (csv_idx, match_type)} using the first full, else first partial, match."""
+    matches = {}
+    for idx, excel_row in excel_df.iterrows():
+        mfl_id = excel_row["MFL ID"]
+        override_id = excel_row["OVERRIDE ID"]
+
+        # Full match
+        full_match = df[
+            (df["clientContentId"] == mfl_id) &
+            (df["performChannel"] == override_id)
+        ]
+        if not full_match.empty:
+            matches[idx] = (full_match.index[0], "full")
+            continue
+
+        # Partial match
+        partial_match = df[
+            ((df["clientContentId"] == mfl_id) & (df["performChannel"] != override_id)) |
+            ((df["performChannel"] == override_id) & (df["clientContentId"] != mfl_id))
+        ]
+        if not partial_match.empty:
+            matches[idx] = (partial_match.index[0], "partial")
+    return matches
+
+def process_files(excel_file, csv_files, store_path=None):
+    """Merges an uploaded Excel export with DynamoDB CSV exports.
+
+    With ``store_path`` set, the uploads are first bulk-loaded into the local
+    snapshot store and matched with indexed SQL queries instead of pandas masks.
+    """
     try:
-        excel_df = pd.read_excel(excel_file, dtype=str)
-        excel_df["MFL ID"] = excel_df["MFL ID"].apply(clean_override_id)
-        excel_df["OVERRIDE ID"] = excel_df["OVERRIDE ID"].apply(clean_override_id)
-        excel_df["DATE TIME PRE KO (UTC)"] = pd.to_datetime(
-            excel_df["DATE TIME PRE KO (UTC)"], errors='coerce', dayfirst=False, format="%Y-%m-%d %H:%M:%S"
-        )
-
-        main_merged = excel_df.copy()
-        csv_data = {}
-        unmatched_data = {}
-
-        for csv_file in csv_files:
-            label = csv_file.name.split('.')[0]
-            df = pd.read_csv(csv_file, dtype=str)
-            df["clientContentId"] = df["clientContentId"].apply(clean_override_id)
-            df["performChannel"] = df["performChannel"].apply(clean_override_id)
-            csv_data[label] = df
-
-        inclusive_merged_rows = []
-        used_csv_indexes = defaultdict(set)
-        unmatched_excel_indexes = []
-
-        for idx, excel_row in main_merged.iterrows():
-            mfl_id = excel_row["MFL ID"]
-            override_id = excel_row["OVERRIDE ID"]
-            row_dict = excel_row.to_dict()
-
-            matched_any = False
-
-            for label, df in csv_data.items():
-                suffix = f"_{label}"
-
-                # Full match
-                full_match = df[
-                    (df["clientContentId"] == mfl_id) &
-                    (df["performChannel"] == override_id)
-                ]
-                if not full_match.empty:
-                    csv_row = full_match.iloc[0]
-                    for c in df.columns:
-                        row_dict[f"{c}{suffix}"] = csv_row[c]
-                    row_dict[f"match_type{suffix}"] = "full"
-                    used_csv_indexes[label].add(csv_row.name)
-                    matched_any = True
-                    continue
-
-                # Partial match
-                partial_match = df[
-                    ((df["clientContentId"] == mfl_id) & (df["performChannel"] != override_id)) |
-                    ((df["performChannel"] == override_id) & (df["clientContentId"] != mfl_id))
-                ]
-                if not partial_match.empty:
-                    csv_row = partial_match.iloc[0]
-                    for c in df.columns:
-                        row_dict[f"{c}{suffix}"] = csv_row[c]
-                    row_dict[f"match_type{suffix}"] = "partial"
+        excel_df = read_excel_frame(excel_file)
+        csv_data = read_csv_frames(csv_files)
+        if store_path:
+            snapshot_id = snapshot_store.save_snapshot(excel_df, csv_data, store_path)
+            return process_snapshot(snapshot_id, store_path)
+        return build_outputs(excel_df, csv_data, match_csv_rows)
+
+    except Exception as e:
+        print("Error in process_files:", e)
+        return None
+
+def process_snapshot(snapshot_id, store_path=snapshot_store.STORE_PATH):
+    """Re-runs the merge and validations against a stored snapshot without re-uploading."""
+    try:
+        excel_df, csv_data = snapshot_store.load_snapshot(snapshot_id, store_path)
+        with snapshot_store.open_store(store_path) as conn:
+            def sql_matcher(excel_df, label, df):
+                return snapshot_store.match_snapshot_rows(conn, snapshot_id, label, excel_df)
+            outputs = build_outputs(excel_df, csv_data, sql_matcher)
+        outputs["snapshot_id"] = snapshot_id
+        return outputs
+
+    except Exception as e:
+        print("Error in process_snapshot:", e)
+        return None
+
+def build_outputs(excel_df, csv_data, matcher):
+    excel_df = excel_df.copy()
+    excel_df["DATE TIME PRE KO (UTC)"] = pd.to_datetime(
+        excel_df["DATE TIME PRE KO (UTC)"], errors='coerce', dayfirst=False, format="%Y-%m-%d %H:%M:%S"
+    )
+
+    main_merged = excel_df
+    matches = {label: matcher(main_merged, label, df) for label, df in csv_data.items()}
+
+    # Anti-joins against the match table: Excel rows no CSV row matched, and
+    # CSV rows no Excel row picked (including surplus rows with a repeated key)
+    excel_matched = pd.Series(False, index=main_merged.index)
+    for label_matches in matches.values():
+        excel_matched |= main_merged.index.isin(list(label_matches))
+    unmatched_excel = main_merged[~excel_matched]
+    unmatched_csv = {
+        label: df[~df.index.isin([csv_idx for csv_idx, _ in matches[label].values()])]
+        for label, df in csv_data.items()
+    }
+
+    inclusive_merged_rows = []
+
+    for idx, excel_row in main_merged[excel_matched].iterrows():
+        override_id = excel_row["OVERRIDE ID"]
+        row_dict = excel_row.to_dict()
+
+        for label, df in csv_data.items():
+            suffix = f"_{label}"
+            match = matches[label].get(idx)
+            if match is not None:
+                csv_idx, match_type = match
+                csv_row = df.loc[csv_idx]
+                for c in df.columns:
+                    row_dict[f"{c}{suffix}"] = csv_row[c]
+                row_dict[f"match_type{suffix}"] = match_type
+                if match_type == "partial":
                     row_dict[f"mismatch_key{suffix}"] = (
                         "MFL ID" if csv_row["performChannel"] == override_id else "OVERRIDE ID"
                     )
-                    used_csv_indexes[label].add(csv_row.name)
-                    matched_any = True
-                else:
-                    # Include keys as empty if not matched
-                    for c in df.columns:
-                        row_dict.setdefault(f"{c}{suffix}", "")
-                    row_dict[f"match_type{suffix}"] = "none"
-
-            if matched_any:
-                inclusive_merged_rows.append(row_dict)
             else:
-                unmatched_excel_indexes.append(idx)
-
-        # Add unmatched Excel rows with empty CSV columns at the end
-        for idx in unmatched_excel_indexes:
-            excel_row = main_merged.loc[idx]
-            row_dict = excel_row.to_dict()
-            for label, df in csv_data.items():
-                suffix = f"_{label}"
+                # Include keys as empty if not matched
                 for c in df.columns:
-                    row_dict[f"{c}{suffix}"] = ""
+                    row_dict.setdefault(f"{c}{suffix}", "")
                 row_dict[f"match_type{suffix}"] = "none"
-            inclusive_merged_rows.append(row_dict)
 
-        # Ensure all key columns for each CSV are present, even if never matched
-        if inclusive_merged_rows:
-            for label, df in csv_data.items():
-                suffix = f"_{label}"
-                for c in df.columns:
-                    colname = f"{c}{suffix}"
-                    if colname not in inclusive_merged_rows[0]:
-                        for row in inclusive_merged_rows:
-                            row[colname] = ""
-
-        merged_df = pd.DataFrame(inclusive_merged_rows)
-
-        # --- New: Add validation to match_type columns ---
-        # Get dynamic suffixes
-        suffixes = get_dynamic_suffixes(merged_df)
-        # Get validate_cell from your style_dataframe's closure
-        validate_cell_func = style_dataframe.__globals__["validate_cell"]
-
-        for suffix in suffixes:
-            match_col = f"match_type_{suffix}"
-            if match_col not in merged_df.columns:
-                continue
-            excel_cols, csv_cols = get_excel_and_csv_cols_for_suffix(merged_df, suffix)
-            for idx, row in merged_df.iterrows():
-                base_val = merged_df.at[idx, match_col]
-                if base_val == "none":
-                    continue  # Leave as "none"
-                all_valid = run_validation_for_row(row, excel_cols, csv_cols, validate_cell_func, idx)
-                merged_df.at[idx, match_col] = f"{base_val}+{'valid' if all_valid else 'invalid'}"
-
-        # Remove match_date column from output if present (optional)
-        if "match_date" in merged_df.columns:
-            merged_df = merged_df.drop(columns=["match_date"])
-
-        # Reorder columns: Excel columns first, then grouped CSV columns
-        excel_cols = [col for col in excel_df.columns if col in merged_df.columns]
-        csv_cols = [
-            col for col in merged_df.columns
-            if col not in excel_cols and not col.startswith("match_type") and not col.startswith("mismatch_key")
-        ]
-        field_groups = defaultdict(list)
-        for col in csv_cols:
-            base = col
-            for label in csv_data.keys():
-                suffix = f"_{label}"
-                if col.endswith(suffix):
-                    base = col[:-len(suffix)]
-                    break
-            field_groups[base].append(col)
-        reordered_cols = excel_cols + [col for base in sorted(field_groups) for col in sorted(field_groups[base])]
-        merged_df = merged_df[
-            reordered_cols + [c for c in merged_df.columns if c.startswith("match_type") or c.startswith("mismatch_key")]
-        ]
+        inclusive_merged_rows.append(row_dict)
 
-        # Output to Excel
-        output = BytesIO()
-        wb = Workbook()
-        ws1 = wb.active
-        ws1.title = "Merged Data"
-        for r in dataframe_to_rows(merged_df, index=False, header=True):
-            ws1.append(r)
-
-        headers = [cell.value for cell in ws1[1]]
-        # Highlight mismatches and partial matches
-        for col_idx, col_name in enumerate(headers, start=1):
-            if "_" in col_name:
-                base_col = col_name.rsplit("_", 1)[0]
-                label = col_name.rsplit("_", 1)[1]
-                suffix = f"_{label}"
-                match_type_col = f"match_type{suffix}"
-                mismatch_key_col = f"mismatch_key{suffix}" if f"mismatch_key{suffix}" in headers else None
-
-                if base_col in headers:
-                    base_col_idx = headers.index(base_col) + 1
-                    for row_idx in range(2, ws1.max_row + 1):
-                        match_type = ws1.cell(row=row_idx, column=headers.index(match_type_col)+1).value if match_type_col in headers else ""
-                        mismatch_key = ws1.cell(row=row_idx, column=headers.index(mismatch_key_col)+1).value if mismatch_key_col and mismatch_key_col in headers else ""
-                        val = ws1.cell(row=row_idx, column=col_idx).value
-                        base_val = ws1.cell(row=row_idx, column=base_col_idx).value
-
-                        if match_type and "partial" in str(match_type) and mismatch_key and base_col == mismatch_key:
-                            ws1.cell(row=row_idx, column=col_idx).fill = red_fill
-                        elif str(val).strip() != str(base_val).strip() and match_type and "full" in str(match_type):
-                            ws1.cell(row=row_idx, column=col_idx).fill = orange_fill
-                        if val is None or str(val).strip() == "":
-                            ws1.cell(row=row_idx, column=col_idx).fill = yellow_fill
-
-        # Add unmatched CSV rows as separate sheets
+    # Add unmatched Excel rows with empty CSV columns at the end
+    for idx, excel_row in unmatched_excel.iterrows():
+        row_dict = excel_row.to_dict()
         for label, df in csv_data.items():
-            unmatched_indexes = set(df.index) - used_csv_indexes[label]
-            unmatched = df.loc[list(unmatched_indexes)] if unmatched_indexes else pd.DataFrame(columns=df.columns)
-            ws_csv = wb.create_sheet(f"Unmatched_{label[:25]}")
-            if not unmatched.empty:
-                for r in dataframe_to_rows(unmatched, index=False, header=True):
-                    ws_csv.append(r)
+            suffix = f"_{label}"
+            for c in df.columns:
+                row_dict[f"{c}{suffix}"] = ""
+            row_dict[f"match_type{suffix}"] = "none"
+        inclusive_merged_rows.append(row_dict)
 
-        wb.save(output)
-        output.seek(0)
-        return {"detailed": output}
+    # Ensure all key columns for each CSV are present, even if never matched
+    if inclusive_merged_rows:
+        for label, df in csv_data.items():
+            suffix = f"_{label}"
+            for c in df.columns:
+                colname = f"{c}{suffix}"
+                if colname not in inclusive_merged_rows[0]:
+                    for row in inclusive_merged_rows:
+                        row[colname] = ""
 
-    except Exception as e:
-        print("Error in process_files:", e)
-        return None
+    merged_df = pd.DataFrame(inclusive_merged_rows)
+
+    # Remove match_date column from output if present (optional)
+    if "match_date" in merged_df.columns:
+        merged_df = merged_df.drop(columns=["match_date"])
+
+    schema = ColumnSchema(merged_df.columns, excel_df.columns, csv_data.keys())
+
+    # --- New: Add validation to match_type columns ---
+    # Same inputs as the original per-row validate_cell check: no schema (so CSV
+    # fields get no CSV rules), no CSV/duplicate context, and any cell that is
+    # not True or "csvgreen" (including "unvalidated") marks the row invalid
+    statuses = validate_frame(merged_df)
+    excel_cols = [col for col in EXCEL_FIELDS if col in merged_df.columns]
+
+    for label in schema.labels:
+        match_col = schema.match_type_col(label)
+        if match_col not in merged_df.columns:
+            continue
+        all_valid = rows_all_valid(statuses, excel_cols + schema.label_to_cols[label], len(merged_df))
+        merged_df[match_col] = [
+            base_val if base_val == "none" else f"{base_val}+{'valid' if valid else 'invalid'}"
+            for base_val, valid in zip(merged_df[match_col], all_valid)
+        ]
+
+    # Reorder columns: Excel columns first, then grouped CSV columns
+    field_groups = defaultdict(list)
+    match_cols = []
+    for col in schema.csv_columns:
+        info = schema.info(col)
+        if info.role == "field":
+            field_groups[info.base].append(col)
+        else:
+            match_cols.append(col)
+    reordered_cols = schema.excel_columns + [col for base in sorted(field_groups) for col in sorted(field_groups[base])]
+    merged_df = merged_df[reordered_cols + match_cols]
+
+    # Output to Excel, streamed: a write-only workbook keeps no cells in memory
+    output = BytesIO()
+    wb = Workbook(write_only=True)
+    taken_titles = set()
+    ws1 = wb.create_sheet(unique_sheet_title("Merged Data", taken_titles))
+
+    headers = list(merged_df.columns)
+    header_index = {col: i for i, col in enumerate(headers)}
+    # (column, its Excel base column, match_type column, mismatch_key column) for highlighted CSV columns
+    highlighted = []
+    for col_idx, col_name in enumerate(headers):
+        info = schema.info(col_name)
+        if info.source != "csv" or info.base not in header_index:
+            continue
+        highlighted.append((
+            col_idx,
+            info.base,
+            header_index[info.base],
+            header_index.get(schema.match_type_col(info.label)),
+            header_index.get(schema.mismatch_key_col(info.label)),
+        ))
+
+    rows = dataframe_to_rows(merged_df, index=False, header=True)
+    ws1.append(next(rows))
+    # Highlight mismatches and partial matches
+    for row in rows:
+        fills = {}
+        for col_idx, base_col, base_col_idx, match_type_idx, mismatch_key_idx in highlighted:
+            match_type = row[match_type_idx] if match_type_idx is not None else ""
+            mismatch_key = row[mismatch_key_idx] if mismatch_key_idx is not None else ""
+            val = row[col_idx]
+            base_val = row[base_col_idx]
+
+            if match_type and "partial" in str(match_type) and mismatch_key and base_col == mismatch_key:
+                fills[col_idx] = red_fill
+            elif str(val).strip() != str(base_val).strip() and match_type and "full" in str(match_type):
+                fills[col_idx] = orange_fill
+            if val is None or str(val).strip() == "":
+                fills[col_idx] = yellow_fill
+        for col_idx, fill in fills.items():
+            cell = WriteOnlyCell(ws1, value=row[col_idx])
+            cell.fill = fill
+            row[col_idx] = cell
+        ws1.append(row)
+
+    # Add unmatched CSV rows as separate sheets, then the unmatched Excel rows
+    for label, unmatched in unmatched_csv.items():
+        ws_csv = wb.create_sheet(unique_sheet_title(f"Unmatched_{label}", taken_titles))
+        if not unmatched.empty:
+            append_frame(ws_csv, unmatched)
+    ws_excel = wb.create_sheet(unique_sheet_title("Unmatched_Excel", taken_titles))
+    if not unmatched_excel.empty:
+        append_frame(ws_excel, unmatched_excel)
+
+    wb.save(output)
+    output.seek(0)
+    # Kept apart so a CSV labelled "Excel" cannot overwrite the Excel count
+    unmatched_counts = {"excel": len(unmatched_excel), "csv": {label: len(df) for label, df in unmatched_csv.items()}}
+    return {"detailed": output, "schema": schema, "unmatched": unmatched_counts}
 
 def merge_files(excel_file, csv_files):
     output = process_files(excel_file, csv_files)
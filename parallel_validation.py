@@ -0,0 +1,123 @@
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from validation_logic import FrameValidator, build_csv_inconsistent_cells, validate_frame
+from validation_rules import CompiledRules, column_strings, load_rules
+
+try:
+    import pyarrow as pa
+except ImportError:  # shards are pickled to the workers instead
+    pa = None
+
+# Worker processes used to validate large merged frames; 1 keeps everything in-process.
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", "1"))
+# Below this many rows, process start-up and transfer costs more than it saves.
+PARALLEL_MIN_ROWS = int(os.environ.get("VALIDATION_PARALLEL_MIN_ROWS", "20000"))
+
+# tmpfs when available, so the shared Arrow file never touches disk
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+_pools = {}
+# Per worker process: rules compiled from the parent's config, by fingerprint
+_worker_rules = {}
+
+def _pool(workers):
+    if workers not in _pools:
+        # spawn: forking a threaded Streamlit server is unsafe
+        _pools[workers] = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pools[workers]
+
+def row_shards(row_count, shards):
+    step = -(-row_count // shards) if row_count else 0
+    return [(start, min(start + step, row_count)) for start in range(0, row_count, step or 1)]
+
+def _write_shared_frame(df):
+    """Writes the frame once as an Arrow IPC file that every worker memory-maps."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fd, path = tempfile.mkstemp(prefix="merged-", suffix=".arrow", dir=SHARED_DIR)
+    with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, table.schema) as writer:
+        writer.write_table(table)
+    return path
+
+def _read_shard(source, start, stop):
+    if isinstance(source, str):
+        with pa.memory_map(source) as mapped:
+            # Zero-copy view of the shared file; only this shard becomes pandas objects
+            table = pa.ipc.open_file(mapped).read_all()
+            df = table.slice(start, stop - start).to_pandas()
+    else:
+        df = source
+    df.index = range(start, stop)
+    return df
+
+def _shard_rules(config, fingerprint):
+    # Workers never read validation_rules.yaml themselves, so they always apply
+    # the rules the parent is serving, even while the file on disk is broken
+    if fingerprint not in _worker_rules:
+        _worker_rules.clear()
+        _worker_rules[fingerprint] = CompiledRules(config)
+    return _worker_rules[fingerprint]
+
+def _validate_shard(source, start, stop, schema, columns, duplicate_positions, config, fingerprint):
+    df = _read_shard(source, start, stop)
+    bases = {schema.base_of(col) for col in columns if schema.is_csv(col)}
+    csv_inconsistent_cells = build_csv_inconsistent_cells(df, {base: schema.base_to_cols[base] for base in bases})
+    duplicate_rows = {start + i for i in duplicate_positions}
+    rules = _shard_rules(config, fingerprint)
+    return validate_frame(df, csv_inconsistent_cells, duplicate_rows, schema, columns, rules)
+
+def validate_frame_parallel(df, schema, columns, duplicate_positions, workers=VALIDATION_WORKERS, rules=None):
+    """validate_frame over row shards in a process pool, stitched back in row order.
+
+    Duplicate rows (as row positions) come from the whole frame; CSV
+    consistency only compares cells within a row, so it is computed per shard.
+    ``rules`` (default: load_rules() in this process) are shipped to the workers.
+    """
+    rules = rules or load_rules()
+    # Values are validated as strings anyway; plain strings keep the Arrow schema simple
+    df = df.apply(column_strings).reset_index(drop=True)
+    shards = row_shards(len(df), workers)
+    shared_path = _write_shared_frame(df) if pa is not None else None
+    try:
+        futures = []
+        for start, stop in shards:
+            source = shared_path if shared_path else df.iloc[start:stop]
+            shard_duplicates = [p - start for p in duplicate_positions if start <= p < stop]
+            futures.append(_pool(workers).submit(
+                _validate_shard, source, start, stop, schema, columns, shard_duplicates,
+                rules.config, rules.fingerprint
+            ))
+        statuses = {col: [] for col in columns}
+        for future in futures:
+            for col, shard_statuses in future.result().items():
+                statuses[col].extend(shard_statuses)
+        return statuses
+    finally:
+        if shared_path:
+            os.remove(shared_path)
+
+class ShardedFrameValidator(FrameValidator):
+    """FrameValidator that validates uncached columns of large frames across processes."""
+
+    def __init__(self, df, schema=None, max_cached_columns=128, workers=VALIDATION_WORKERS):
+        super().__init__(df, schema, max_cached_columns)
+        self.workers = workers
+
+    def statuses(self, columns=None):
+        columns = list(self.df.columns) if columns is None else columns
+        if self.workers <= 1 or len(self.df) < PARALLEL_MIN_ROWS:
+            return super().statuses(columns)
+        with self._lock:
+            rules = self._current_rules()
+            missing = [col for col in columns if col not in self._statuses]
+            computed = {}
+            if missing:
+                computed = validate_frame_parallel(
+                    self.df, self.schema, missing, self._duplicate_positions, self.workers, rules
+                )
+                for col, result in computed.items():
+                    self._remember(col, result)
+            return {col: computed[col] if col in computed else self.column_status(col) for col in columns}
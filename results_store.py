@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import shutil
+import threading
+import time
+import uuid
+from io import BytesIO
+from collections import OrderedDict
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+from column_schema import ColumnSchema
+from validation_logic import FrameValidator
+
+# Merge results shared by every session and worker on this machine, one directory per run.
+RESULTS_DIR = os.environ.get("MERGE_RESULTS_DIR", "merge_results")
+# Least recently used runs are deleted once the directory grows past this size.
+RESULTS_MAX_BYTES = int(os.environ.get("MERGE_RESULTS_MAX_BYTES", str(2 * 1024 ** 3)))
+# Runs kept open (memory-mapped, with a pandas view and validator) per process.
+OPEN_RUNS_LIMIT = int(os.environ.get("MERGE_OPEN_RUNS_LIMIT", "8"))
+
+MERGED_ARROW = "merged.arrow"
+MERGED_XLSX = "merged.xlsx"
+META_JSON = "meta.json"
+
+RUN_ID_PATTERN = re.compile(r"^[0-9T]+-[0-9a-f]+$")
+
+class RunNotFound(KeyError):
+    pass
+
+class Run:
+    """A stored merge result, opened zero-copy from its memory-mapped Arrow file."""
+
+    def __init__(self, run_id, path):
+        self.run_id = run_id
+        self.path = path
+        with open(os.path.join(path, META_JSON), "r") as f:
+            self.meta = json.load(f)
+        self.table = pa.ipc.open_file(pa.memory_map(os.path.join(path, MERGED_ARROW))).read_all()
+        # Arrow-backed strings keep pointing into the mapped file instead of copying to Python objects
+        self.df = self.table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+        self.schema = ColumnSchema(self.df.columns, self.meta["excel_columns"], self.meta["labels"])
+        self._validator = None
+        self._lock = threading.Lock()
+
+    def validator(self, factory=FrameValidator):
+        """One validator per run per process, shared by every session viewing it."""
+        with self._lock:
+            if self._validator is None:
+                self._validator = factory(self.df, self.schema)
+            return self._validator
+
+    def file_path(self, name):
+        return os.path.join(self.path, name)
+
+    def excel_bytes(self):
+        with open(self.file_path(MERGED_XLSX), "rb") as f:
+            return f.read()
+
+_open_runs = OrderedDict()
+_open_lock = threading.Lock()
+
+def _run_path(run_id, results_dir=RESULTS_DIR):
+    # Run ids also arrive from URLs; never let one point outside the store
+    if not RUN_ID_PATTERN.match(run_id):
+        raise RunNotFound(run_id)
+    return os.path.join(results_dir, run_id)
+
+def new_run_id():
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+def save_run(merged_df, merged_excel_bytes, schema, meta=None, results_dir=RESULTS_DIR, max_bytes=RESULTS_MAX_BYTES):
+    """Persists a merge result once and returns its run id."""
+    run_id = new_run_id()
+    os.makedirs(results_dir, exist_ok=True)
+    tmp_path = os.path.join(results_dir, f".{run_id}.tmp")
+    os.makedirs(tmp_path)
+    table = pa.Table.from_pandas(merged_df.astype(str), preserve_index=False)
+    with pa.OSFile(os.path.join(tmp_path, MERGED_ARROW), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    with open(os.path.join(tmp_path, MERGED_XLSX), "wb") as f:
+        f.write(merged_excel_bytes)
+    run_meta = {
+        "run_id": run_id,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        # Orders runs created within the same second
+        "created_ns": time.time_ns(),
+        "rows": len(merged_df),
+        "excel_columns": schema.excel_columns,
+        "labels": schema.labels,
+        **(meta or {}),
+    }
+    with open(os.path.join(tmp_path, META_JSON), "w") as f:
+        json.dump(run_meta, f, indent=4)
+    # Readers only ever see complete runs
+    os.rename(tmp_path, _run_path(run_id, results_dir))
+    evict(max_bytes, results_dir, keep=run_id)
+    return run_id
+
+def save_outputs(outputs, meta=None, results_dir=RESULTS_DIR):
+    """Stores a ``process_files`` result (either merge engine) and returns its run id."""
+    merged_excel_bytes = outputs["detailed"].getvalue()
+    merged_df = pd.read_excel(
+        BytesIO(merged_excel_bytes),
+        sheet_name="Merged Data",
+        dtype=str, keep_default_na=False
+    )
+    merged_df = merged_df.fillna("")
+    schema = outputs.get("schema") or ColumnSchema.infer(merged_df.columns)
+    meta = dict(meta or {})
+    if outputs.get("unmatched") is not None:
+        meta["unmatched"] = outputs["unmatched"]
+    return save_run(merged_df, merged_excel_bytes, schema, meta, results_dir)
+
+def created_ns(meta):
+    """When a run was stored, from its meta; runs stored before created_ns existed fall back to created_at."""
+    if "created_ns" in meta:
+        return meta["created_ns"]
+    return int(datetime.fromisoformat(meta["created_at"]).timestamp()) * 10 ** 9
+
+def run_file_path(run_id, name, results_dir=RESULTS_DIR):
+    """Path of a file in a stored run, without opening it or marking it as used."""
+    return os.path.join(_run_path(run_id, results_dir), name)
+
+def open_run(run_id, results_dir=RESULTS_DIR):
+    """The shared Run for ``run_id``; raises RunNotFound once it has been evicted."""
+    path = _run_path(run_id, results_dir)
+    with _open_lock:
+        run = _open_runs.get(path)
+        if run is not None and os.path.isdir(path):
+            _open_runs.move_to_end(path)
+        else:
+            if not os.path.exists(os.path.join(path, META_JSON)):
+                _open_runs.pop(path, None)
+                raise RunNotFound(run_id)
+            run = Run(run_id, path)
+            _open_runs[path] = run
+            if len(_open_runs) > OPEN_RUNS_LIMIT:
+                _open_runs.popitem(last=False)
+    # Marks the run as recently used for eviction
+    os.utime(path)
+    return run
+
+def list_runs(results_dir=RESULTS_DIR):
+    runs = []
+    if not os.path.isdir(results_dir):
+        return runs
+    for run_id in sorted(os.listdir(results_dir), reverse=True):
+        meta_path = os.path.join(results_dir, run_id, META_JSON)
+        if not RUN_ID_PATTERN.match(run_id) or not os.path.exists(meta_path):
+            continue
+        with open(meta_path, "r") as f:
+            runs.append(json.load(f))
+    return runs
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+def evict(max_bytes=RESULTS_MAX_BYTES, results_dir=RESULTS_DIR, keep=None):
+    """Deletes least recently used runs until the store fits in ``max_bytes``."""
+    runs = []
+    for run_id in os.listdir(results_dir):
+        path = os.path.join(results_dir, run_id)
+        if not RUN_ID_PATTERN.match(run_id) or not os.path.isdir(path):
+            continue
+        runs.append((os.path.getmtime(path), run_id, path, _dir_size(path)))
+    total = sum(size for _, _, _, size in runs)
+    evicted = []
+    for _, run_id, path, size in sorted(runs):
+        if total <= max_bytes:
+            break
+        if run_id == keep:
+            continue
+        # Sessions that already mapped the files keep reading them until they let go
+        shutil.rmtree(path, ignore_errors=True)
+        with _open_lock:
+            _open_runs.pop(path, None)
+        total -= size
+        evicted.append(run_id)
+    return evicted
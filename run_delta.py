@@ -0,0 +1,251 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import results_store
+from validation_logic import build_csv_inconsistent_cells, validate_frame
+from validation_rules import load_rules
+
+ROWS_ARROW = "rows.arrow"
+STATUSES_ARROW = "statuses.arrow"
+CHANGES_ARROW = "changes.arrow"
+DELTA_JSON = "delta.json"
+
+# Excel fields that identify a fixture from one run to the next
+KEY_FIELDS = ["MFL ID", "OVERRIDE ID"]
+
+# Every status validation produces, in code order; statuses are stored and compared as these codes
+STATUSES = [True, False, "duplicate", "csvred", "csvgreen", "unvalidated"]
+STATUS_CODES = {str(status): code for code, status in enumerate(STATUSES)}
+_STATUS_OBJECTS = np.array(STATUSES, dtype=object)
+_STATUS_DICTIONARY = pa.array([str(status) for status in STATUSES])
+
+def row_keys(df):
+    """Stable row identity across runs; repeated keys are told apart by occurrence."""
+    keys = pd.Series("", index=df.index)
+    for col in KEY_FIELDS:
+        if col in df.columns:
+            keys = keys + "|" + df[col].astype(str)
+    occurrence = keys.groupby(keys).cumcount().astype(str)
+    return (keys + "#" + occurrence).to_numpy(dtype=object)
+
+def content_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def encode_statuses(statuses):
+    """``{col: [status per row]}`` as an int8 code matrix, one column per status column."""
+    codes = np.empty((len(next(iter(statuses.values()), [])), len(statuses)), dtype=np.int8)
+    for j, values in enumerate(statuses.values()):
+        # Each distinct status is looked up once, not once per cell
+        local, uniques = pd.factorize(np.asarray(values, dtype=object))
+        codes[:, j] = np.array([STATUS_CODES[str(status)] for status in uniques], dtype=np.int8)[local]
+    return codes
+
+def decode_statuses(codes, columns):
+    return {col: _STATUS_OBJECTS[codes[:, j]].tolist() for j, col in enumerate(columns)}
+
+def _write_arrow(table, path):
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def _read_arrow(path):
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+def write_fingerprints(run, codes, duplicate, keys=None, content=None):
+    """Stores this run's per-row fingerprints and status codes for the next delta run."""
+    columns = list(run.df.columns)
+    table = pa.table({
+        col: pa.DictionaryArray.from_arrays(pa.array(codes[:, j]), _STATUS_DICTIONARY)
+        for j, col in enumerate(columns)
+    })
+    _write_arrow(table, run.file_path(STATUSES_ARROW))
+    rows = pa.table({
+        "key": row_keys(run.df) if keys is None else keys,
+        "content_hash": content_hashes(run.df) if content is None else content,
+        "duplicate": np.asarray(duplicate, dtype=bool),
+    }).replace_schema_metadata({
+        "columns": json.dumps(columns),
+        "rules": load_rules().fingerprint,
+    })
+    # Written last: its presence means the run's fingerprints are complete
+    _write_arrow(rows, run.file_path(ROWS_ARROW))
+
+def has_fingerprints(run):
+    return os.path.exists(run.file_path(ROWS_ARROW))
+
+def ensure_fingerprints(run, validator):
+    if not has_fingerprints(run):
+        codes = encode_statuses(validator.statuses())
+        write_fingerprints(run, codes, run.df.index.isin(validator.duplicate_rows))
+
+def previous_run(run):
+    """The newest stored run created before ``run`` that has fingerprints.
+
+    Candidates are ordered by their stored creation time and checked through
+    their metadata and file paths only, so runs that are passed over keep
+    their place in the eviction order.
+    """
+    results_dir = os.path.dirname(run.path)
+    created = results_store.created_ns(run.meta)
+    earlier = [
+        meta for meta in results_store.list_runs(results_dir)
+        if meta["run_id"] != run.run_id and results_store.created_ns(meta) < created
+    ]
+    for meta in sorted(earlier, key=results_store.created_ns, reverse=True):
+        if not os.path.exists(results_store.run_file_path(meta["run_id"], ROWS_ARROW, results_dir)):
+            continue
+        try:
+            return results_store.open_run(meta["run_id"], results_dir)
+        except results_store.RunNotFound:
+            continue
+    return None
+
+def status_codes(run, columns):
+    """The run's stored statuses as a code matrix over ``columns``; -1 where it has no such column."""
+    table = _read_arrow(run.file_path(STATUSES_ARROW))
+    codes = np.full((table.num_rows, len(columns)), -1, dtype=np.int8)
+    for j, col in enumerate(columns):
+        if col not in table.column_names:
+            continue
+        column = table.column(col).combine_chunks()
+        # Maps the stored dictionary onto STATUSES, then indexes by the stored codes
+        mapping = np.array([STATUS_CODES[value] for value in column.dictionary.to_pylist()], dtype=np.int8)
+        codes[:, j] = mapping[column.indices.to_numpy(zero_copy_only=False)]
+    return codes
+
+def delta_validate(run, validator, previous):
+    """Validates only the rows that changed since ``previous`` and primes ``validator``.
+
+    A row's statuses depend only on its own values, whether it is a duplicate
+    and the rules, so a row with the same key, content and duplicate flag
+    reuses its previous statuses, as long as the columns and rules match.
+    Stores this run's fingerprints and the changes, and returns a summary.
+    """
+    df = run.df
+    columns = list(df.columns)
+    rules = load_rules()
+    duplicate = df.index.isin(validator.duplicate_rows)
+    # Computed once and shared with the fingerprints and the change list
+    keys = row_keys(df)
+    content = content_hashes(df)
+    current = pd.DataFrame({
+        "key": keys,
+        "content_hash": content,
+        "duplicate": duplicate,
+        "position": np.arange(len(df)),
+    })
+
+    prev_codes = None
+    reusable = previous is not None
+    if reusable:
+        prev_rows = _read_arrow(previous.file_path(ROWS_ARROW))
+        prev_meta = prev_rows.schema.metadata or {}
+        prev_codes = status_codes(previous, columns)
+        reusable = (
+            json.loads(prev_meta.get(b"columns", b"[]")) == columns
+            and prev_meta.get(b"rules", b"").decode() == rules.fingerprint
+        )
+    if reusable:
+        prev = prev_rows.select(["key", "content_hash", "duplicate"]).to_pandas()
+        prev["prev_position"] = np.arange(len(prev))
+        matched = current.merge(prev, on=["key", "content_hash", "duplicate"], how="left")
+        reused = matched["prev_position"].notna().to_numpy()
+        reused_positions = matched["position"].to_numpy()[reused]
+        changed_positions = matched["position"].to_numpy()[~reused]
+        reused_from = matched["prev_position"].to_numpy()[reused].astype(np.int64)
+    else:
+        reused_positions = np.array([], dtype=np.int64)
+        changed_positions = np.arange(len(df))
+
+    codes = np.empty((len(df), len(columns)), dtype=np.int8)
+    if len(changed_positions):
+        subset = df.iloc[changed_positions]
+        fresh = validate_frame(
+            subset,
+            build_csv_inconsistent_cells(subset, validator.schema.base_to_cols),
+            set(subset.index) & validator.duplicate_rows,
+            validator.schema,
+            rules=rules,
+        )
+        codes[changed_positions] = encode_statuses({col: fresh[col] for col in columns})
+    if len(reused_positions):
+        codes[reused_positions] = prev_codes[reused_from]
+
+    validator.prime(decode_statuses(codes, columns))
+    write_fingerprints(run, codes, duplicate, keys, content)
+    summary = {
+        "previous_run_id": previous.run_id if previous is not None else None,
+        "reused_rows": len(reused_positions),
+        "revalidated_rows": len(changed_positions),
+    }
+    if previous is not None:
+        changes = changes_since(run, previous, codes, keys, content, prev_codes)
+        _write_arrow(pa.Table.from_pandas(changes, preserve_index=False), run.file_path(CHANGES_ARROW))
+        summary.update(changes["change"].value_counts().to_dict())
+    with open(run.file_path(DELTA_JSON), "w") as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+def changes_since(run, previous, codes, keys=None, content=None, prev_codes=None):
+    """Rows added, removed or changed (in value or status) since ``previous``.
+
+    ``codes`` are this run's status codes (see encode_statuses);
+    ``changed_columns`` lists the columns whose value or status differs.
+    """
+    columns = list(run.df.columns)
+    new_rows = pd.DataFrame({
+        "key": row_keys(run.df) if keys is None else keys,
+        "content_hash": content_hashes(run.df) if content is None else content,
+        "position": np.arange(len(run.df)),
+    })
+    if prev_codes is None:
+        prev_codes = status_codes(previous, columns)
+    prev_rows = _read_arrow(previous.file_path(ROWS_ARROW)).select(["key", "content_hash"]).to_pandas()
+    prev_rows["prev_position"] = np.arange(len(prev_rows))
+    both = new_rows.merge(prev_rows, on="key", how="outer", suffixes=("", "_prev"), indicator=True)
+    added = both[both["_merge"] == "left_only"]
+    removed = both[both["_merge"] == "right_only"]
+    paired = both[both["_merge"] == "both"]
+    paired_positions = paired["position"].to_numpy().astype(np.int64)
+    paired_prev = paired["prev_position"].to_numpy().astype(np.int64)
+    status_differs = codes[paired_positions] != prev_codes[paired_prev]
+    is_changed = (
+        (paired["content_hash"].to_numpy() != paired["content_hash_prev"].to_numpy())
+        | status_differs.any(axis=1)
+    )
+    changed_positions = paired_positions[is_changed]
+    prev_positions = paired_prev[is_changed]
+
+    # Only the rows that changed are converted to Python objects
+    new_changed = run.df.iloc[changed_positions].astype(object)
+    prev_changed = previous.df.iloc[prev_positions].reindex(columns=columns).astype(object)
+    differs = (new_changed.to_numpy() != prev_changed.to_numpy()) | status_differs[is_changed]
+    names = np.asarray(columns, dtype=object)
+    changed_columns = [", ".join(names[row]) for row in differs]
+
+    parts = []
+    for change, frame, positions in [
+        ("added", run.df, added["position"].astype(int).tolist()),
+        ("changed", run.df, changed_positions),
+        ("removed", previous.df.reindex(columns=columns), removed["prev_position"].astype(int).tolist()),
+    ]:
+        part = frame.iloc[positions].astype(object)
+        part.insert(0, "change", change)
+        part.insert(1, "changed_columns", changed_columns if change == "changed" else "")
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True).fillna("")
+
+def load_changes(run):
+    """The run's changes since its previous run and the delta summary, or (None, None)."""
+    if not os.path.exists(run.file_path(DELTA_JSON)):
+        return None, None
+    with open(run.file_path(DELTA_JSON), "r") as f:
+        summary = json.load(f)
+    changes = None
+    if os.path.exists(run.file_path(CHANGES_ARROW)):
+        changes = _read_arrow(run.file_path(CHANGES_ARROW)).to_pandas()
+    return changes, summary
@@ -0,0 +1,149 @@
+import os
+import csv
+import io
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+import results_store
+import run_delta
+from parallel_validation import ShardedFrameValidator
+
+# Background threads building download files; one keeps exports from competing with page renders.
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "1"))
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _validated_xlsx(run, path):
+    styled = run.validator(ShardedFrameValidator).style()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        styled.to_excel(writer, index=False, sheet_name="StyledData")
+
+def _merged_csv(run, path):
+    pa_csv.write_csv(run.table, path, pa_csv.WriteOptions(quoting_style="needed"))
+
+def _merged_parquet(run, path):
+    pq.write_table(run.table, path)
+
+def _sheets_zip(run, path):
+    # Merged Data plus every Unmatched_* sheet, one CSV each, streamed row by row
+    wb = load_workbook(run.file_path(results_store.MERGED_XLSX), read_only=True)
+    try:
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+            for ws in wb.worksheets:
+                with bundle.open(f"{ws.title}.csv", "w") as raw:
+                    out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+                    writer = csv.writer(out)
+                    for row in ws.iter_rows(values_only=True):
+                        writer.writerow(["" if value is None else value for value in row])
+                    out.flush()
+                    out.detach()
+    finally:
+        wb.close()
+
+# name: (file in the run directory, download file name, mime type, builder)
+EXPORTS = {
+    "validated_xlsx": ("validated.xlsx", "validated_output.xlsx", XLSX_MIME, _validated_xlsx),
+    "csv": ("merged.csv", "merged_output.csv", "text/csv", _merged_csv),
+    "parquet": ("merged.parquet", "merged_output.parquet", "application/vnd.apache.parquet", _merged_parquet),
+    "sheets_zip": ("sheets.zip", "merged_sheets.zip", "application/zip", _sheets_zip),
+}
+
+_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="exports")
+_scheduled = set()
+_failed = {}
+_lock = threading.Lock()
+
+def _mark_unfinished(run_id, error):
+    # Anything not built by now never will be in this process; ready files stay ready
+    with _lock:
+        for name in EXPORTS:
+            _failed.setdefault((run_id, name), error)
+
+def build_exports(run):
+    """Builds the run's missing download files and row fingerprints in this thread."""
+    run_id = run.run_id
+    for name, (file_name, _, _, build) in EXPORTS.items():
+        path = run.file_path(file_name)
+        if os.path.exists(path):
+            continue
+        root, ext = os.path.splitext(path)
+        # Keeps the extension, which the xlsx writer checks
+        tmp_path = f"{root}.tmp{ext}"
+        try:
+            build(run, tmp_path)
+            # Readers only ever see finished files
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error building {name} for run {run_id}:", e)
+            with _lock:
+                _failed[(run_id, name)] = str(e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    try:
+        # Lets the next run validate in delta mode against this one
+        run_delta.ensure_fingerprints(run, run.validator(ShardedFrameValidator))
+    except Exception as e:
+        print(f"Error storing row fingerprints for run {run_id}:", e)
+
+def _build_exports(run_id):
+    try:
+        run = results_store.open_run(run_id)
+    except results_store.RunNotFound:
+        _mark_unfinished(run_id, "run was evicted from the run store")
+        return
+    build_exports(run)
+
+def _run_build(run_id):
+    try:
+        _build_exports(run_id)
+    except Exception as e:
+        print(f"Error building exports for run {run_id}:", e)
+        _mark_unfinished(run_id, str(e))
+    else:
+        # e.g. the run directory was evicted between two builders
+        _mark_unfinished(run_id, "export was not built")
+
+def _check_build(future, run_id):
+    if future.cancelled():
+        _mark_unfinished(run_id, "export job was cancelled")
+    elif future.exception() is not None:
+        _mark_unfinished(run_id, str(future.exception()))
+
+def schedule_exports(run_id):
+    """Starts building a run's missing download files, once per run per process."""
+    with _lock:
+        if run_id in _scheduled:
+            return
+        _scheduled.add(run_id)
+    try:
+        future = _pool.submit(_run_build, run_id)
+    except RuntimeError as e:  # the pool is shutting down
+        _mark_unfinished(run_id, str(e))
+        return
+    future.add_done_callback(lambda done: _check_build(done, run_id))
+
+def export_status(run):
+    """``{name: "ready" | "pending" | "failed"}`` for every export of the run."""
+    status = {}
+    for name, (file_name, _, _, _) in EXPORTS.items():
+        if os.path.exists(run.file_path(file_name)):
+            status[name] = "ready"
+        elif (run.run_id, name) in _failed:
+            status[name] = "failed"
+        else:
+            status[name] = "pending"
+    return status
+
+def export_errors(run):
+    """``{name: error}`` for the run's exports that failed."""
+    return {
+        name: _failed[(run.run_id, name)]
+        for name, status in export_status(run).items() if status == "failed"
+    }
+
+def export_path(run, name):
+    return run.file_path(EXPORTS[name][0])
@@ -0,0 +1,57 @@
+import os
+import cProfile
+import pstats
+import pandas as pd
+import run_exports
+
+PROFILE_FILE = "profile.prof"
+HOTSPOTS_CSV = "hotspots.csv"
+# Functions kept in the hot-spot table, by self time.
+HOTSPOT_ROWS = int(os.environ.get("PROFILE_HOTSPOT_ROWS", "200"))
+
+def new_profiler():
+    return cProfile.Profile()
+
+def call(profiler, func, *args, **kwargs):
+    """``func(*args, **kwargs)``, under ``profiler`` when there is one."""
+    if profiler is None:
+        return func(*args, **kwargs)
+    return profiler.runcall(func, *args, **kwargs)
+
+def profile_exports(profiler, run):
+    """Profiles what a fresh run costs after the merge: the run's shared validator
+    styling every column, each download export and the row fingerprints.
+
+    The files are the run's real exports, so the background job finds them done.
+    """
+    profiler.runcall(run_exports.build_exports, run)
+
+def hotspots(profiler, limit=HOTSPOT_ROWS):
+    """Per-function totals, slowest self time first."""
+    rows = []
+    for (file_name, line, function), (primitive_calls, calls, self_time, cumulative_time, _) in pstats.Stats(profiler).stats.items():
+        rows.append({
+            "function": function,
+            "file": file_name,
+            "line": line,
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "self_s": round(self_time, 6),
+            "cumulative_s": round(cumulative_time, 6),
+            "per_call_ms": round(cumulative_time / calls * 1000, 4) if calls else 0.0,
+        })
+    table = pd.DataFrame(rows, columns=[
+        "function", "file", "line", "calls", "primitive_calls", "self_s", "cumulative_s", "per_call_ms",
+    ])
+    return table.sort_values("self_s", ascending=False).head(limit).reset_index(drop=True)
+
+def save_profile(profiler, run):
+    """Stores the raw profile (for snakeviz/pstats) and the hot-spot table with the run."""
+    profiler.dump_stats(run.file_path(PROFILE_FILE))
+    hotspots(profiler).to_csv(run.file_path(HOTSPOTS_CSV), index=False)
+
+def load_hotspots(run):
+    path = run.file_path(HOTSPOTS_CSV)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
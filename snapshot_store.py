@@ -0,0 +1,231 @@
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Local SQLite file holding ingested Excel/CSV snapshots (never shared or uploaded).
+STORE_PATH = os.environ.get("MERGE_STORE_PATH", "merge_snapshots.db")
+
+# Snapshots kept after each save, newest first; older ones are dropped. 0 keeps everything.
+SNAPSHOT_KEEP = int(os.environ.get("MERGE_STORE_KEEP", "30"))
+
+# CSV columns that the merge looks rows up by; each gets its own index.
+KEY_COLUMNS = ("clientContentId", "performChannel")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    note TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS frames (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id),
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    PRIMARY KEY (snapshot_id, position)
+);
+"""
+
+def connect(path=STORE_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+@contextmanager
+def open_store(path=STORE_PATH):
+    """Connection that commits on success and is always closed."""
+    conn = connect(path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _physical_columns(columns):
+    # Source headers contain spaces and brackets, so data tables use positional names.
+    return [f"c{i}" for i in range(len(columns))]
+
+def _write_frame(conn, snapshot_id, position, kind, label, df):
+    table_name = f"frame_{snapshot_id}_{position}"
+    columns = list(df.columns)
+    physical = _physical_columns(columns)
+    col_defs = ", ".join(f"{c} TEXT" for c in physical)
+    conn.execute(f"CREATE TABLE {table_name} (row_idx INTEGER PRIMARY KEY, {col_defs})")
+    placeholders = ", ".join("?" for _ in range(len(physical) + 1))
+    values = df.astype(object).where(df.notna(), None)
+    conn.executemany(
+        f"INSERT INTO {table_name} VALUES ({placeholders})",
+        ((int(idx), *(None if v is None else str(v) for v in row))
+         for idx, row in zip(values.index, values.itertuples(index=False, name=None))),
+    )
+    if kind == "csv":
+        for key in KEY_COLUMNS:
+            if key in columns:
+                phys = physical[columns.index(key)]
+                conn.execute(f"CREATE INDEX {table_name}_{phys} ON {table_name} ({phys})")
+    conn.execute(
+        "INSERT INTO frames (snapshot_id, position, kind, label, table_name, columns, row_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (snapshot_id, position, kind, label, table_name, json.dumps(columns), len(df)),
+    )
+
+def save_snapshot(excel_df, csv_data, path=STORE_PATH, note="", keep=SNAPSHOT_KEEP):
+    """Bulk-loads an Excel frame and its labelled CSV frames; returns the new snapshot id.
+
+    Afterwards only the newest ``keep`` snapshots are kept (0 keeps all).
+    """
+    with open_store(path) as conn:
+        cur = conn.execute(
+            "INSERT INTO snapshots (created_at, note) VALUES (?, ?)",
+            (datetime.now(timezone.utc).isoformat(timespec="seconds"), note),
+        )
+        snapshot_id = cur.lastrowid
+        _write_frame(conn, snapshot_id, 0, "excel", "", excel_df)
+        for position, (label, df) in enumerate(csv_data.items(), start=1):
+            _write_frame(conn, snapshot_id, position, "csv", label, df)
+    if keep:
+        prune_snapshots(keep, path)
+    return snapshot_id
+
+def delete_snapshots(snapshot_ids, path=STORE_PATH):
+    """Drops the snapshots' frame tables and rows, then compacts the file; returns how many were deleted."""
+    snapshot_ids = [int(snapshot_id) for snapshot_id in snapshot_ids]
+    if not snapshot_ids or not os.path.exists(path):
+        return 0
+    with open_store(path) as conn:
+        placeholders = ", ".join("?" for _ in snapshot_ids)
+        tables = conn.execute(
+            f"SELECT table_name FROM frames WHERE snapshot_id IN ({placeholders})", snapshot_ids
+        ).fetchall()
+        for (table_name,) in tables:
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.execute(f"DELETE FROM frames WHERE snapshot_id IN ({placeholders})", snapshot_ids)
+        deleted = conn.execute(f"DELETE FROM snapshots WHERE id IN ({placeholders})", snapshot_ids).rowcount
+    if deleted:
+        # Dropped tables only free pages inside the file; VACUUM gives the space back
+        conn = connect(path)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    return deleted
+
+def prune_snapshots(keep=SNAPSHOT_KEEP, path=STORE_PATH):
+    """Deletes all but the newest ``keep`` snapshots; returns how many were deleted."""
+    if not os.path.exists(path):
+        return 0
+    with open_store(path) as conn:
+        old = conn.execute("SELECT id FROM snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (keep,)).fetchall()
+    return delete_snapshots([snapshot_id for (snapshot_id,) in old], path)
+
+_listings = {}
+
+def _store_stamp(path):
+    # WAL mode: commits land in the -wal file before they reach the database file
+    stamp = []
+    for name in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(name)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def list_snapshots(path=STORE_PATH):
+    """Stored snapshots, newest first; re-read only when the store's files change."""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["id", "created_at", "note", "labels", "excel_rows"])
+    stamp = _store_stamp(path)
+    cached = _listings.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1].copy()
+    with open_store(path) as conn:
+        rows = conn.execute(
+            "SELECT s.id, s.created_at, s.note, "
+            "GROUP_CONCAT(CASE WHEN f.kind = 'csv' THEN f.label END, ', '), "
+            "MAX(CASE WHEN f.kind = 'excel' THEN f.row_count END) "
+            "FROM snapshots s JOIN frames f ON f.snapshot_id = s.id "
+            "GROUP BY s.id ORDER BY s.id DESC"
+        ).fetchall()
+    listing = pd.DataFrame(rows, columns=["id", "created_at", "note", "labels", "excel_rows"])
+    _listings[path] = (stamp, listing)
+    return listing.copy()
+
+def _frames(conn, snapshot_id):
+    rows = conn.execute(
+        "SELECT kind, label, table_name, columns FROM frames WHERE snapshot_id = ? ORDER BY position",
+        (snapshot_id,),
+    ).fetchall()
+    if not rows:
+        raise KeyError(f"Snapshot {snapshot_id} not found")
+    return [(kind, label, table_name, json.loads(columns)) for kind, label, table_name, columns in rows]
+
+def _read_frame(conn, table_name, columns):
+    df = pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY row_idx", conn, index_col="row_idx")
+    df.index.name = None
+    df.columns = columns
+    # NULLs come back as None; the merge expects the NaN that read_excel/read_csv produce.
+    return df.astype(object).where(df.notna(), np.nan)
+
+def load_snapshot(snapshot_id, path=STORE_PATH):
+    """Returns (excel_df, csv_data) exactly as they were ingested."""
+    with open_store(path) as conn:
+        excel_df = None
+        csv_data = {}
+        for kind, label, table_name, columns in _frames(conn, snapshot_id):
+            df = _read_frame(conn, table_name, columns)
+            if kind == "excel":
+                excel_df = df
+            else:
+                csv_data[label] = df
+    return excel_df, csv_data
+
+def match_snapshot_rows(conn, snapshot_id, label, excel_df):
+    """Indexed SQL version of merge_csv_only.match_csv_rows for one stored CSV label."""
+    frame = next(
+        (f for f in _frames(conn, snapshot_id) if f[0] == "csv" and f[1] == label), None
+    )
+    if frame is None:
+        raise KeyError(f"Label {label!r} not in snapshot {snapshot_id}")
+    _, _, table_name, columns = frame
+    physical = _physical_columns(columns)
+    cc = physical[columns.index("clientContentId")]
+    pc = physical[columns.index("performChannel")]
+
+    conn.execute("DROP TABLE IF EXISTS temp.excel_keys")
+    conn.execute("CREATE TEMP TABLE excel_keys (row_idx INTEGER PRIMARY KEY, mfl TEXT, ovr TEXT)")
+    conn.executemany(
+        "INSERT INTO excel_keys VALUES (?, ?, ?)",
+        zip((int(i) for i in excel_df.index), excel_df["MFL ID"], excel_df["OVERRIDE ID"]),
+    )
+
+    def first_rows(condition):
+        return dict(conn.execute(
+            f"SELECT k.row_idx, MIN(c.row_idx) FROM excel_keys k "
+            f"JOIN {table_name} c ON {condition} GROUP BY k.row_idx"
+        ).fetchall())
+
+    full = first_rows(f"c.{cc} = k.mfl AND c.{pc} = k.ovr")
+    # Each half of the partial match is a separate query so both can use an index.
+    by_mfl = first_rows(f"c.{cc} = k.mfl AND c.{pc} <> k.ovr")
+    by_override = first_rows(f"c.{pc} = k.ovr AND c.{cc} <> k.mfl")
+    conn.execute("DROP TABLE temp.excel_keys")
+
+    matches = {}
+    for idx in excel_df.index:
+        if idx in full:
+            matches[idx] = (full[idx], "full")
+            continue
+        candidates = [r for r in (by_mfl.get(idx), by_override.get(idx)) if r is not None]
+        if candidates:
+            matches[idx] = (min(candidates), "partial")
+    return matches
@@ -1,6 +1,9 @@
 import re
+import threading
 import pandas as pd
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from validation_rules import load_rules, column_strings, safe_str
+from column_schema import ColumnSchema
 
 EXCEL_FIELDS = [
     "DATE TIME PRE KO (UTC)", "KO (UTC)", "REGION", "SPORT", "PROPERTY",
@@ -49,30 +52,12 @@ def match_hdr_override_id(value):
     except Exception:
         return False
 
-def safe_str(val):
-    if val is None:
-        return ""
-    if isinstance(val, float) and pd.isna(val):
-        return ""
-    return str(val)
-
 def is_sdr_override_id(value):
     return match_sdr_override_id(value)
 
 def is_hdr_override_id(value):
     return match_hdr_override_id(value)
 
-def get_dynamic_csv_bases_and_suffixes(df):
-    """Dynamically get all base names and suffixes from DataFrame columns."""
-    base_to_cols = defaultdict(list)
-    seen_suffixes = set()
-    for col in df.columns:
-        if '_' in col:
-            base, suffix = col.rsplit('_', 1)
-            base_to_cols[base].append(col)
-            seen_suffixes.add(suffix)
-    return base_to_cols, seen_suffixes
-
 def find_duplicate_rows(df):
     duplicated = df.duplicated(keep='first')
     return set(df[duplicated].index)
@@ -80,18 +65,21 @@ def find_duplicate_rows(df):
 def build_csv_inconsistent_cells(df, base_to_cols):
     """Returns a dict of (row_idx, col): 'csvunmatch' or 'csvmatch' for inconsistent/matching CSV cells."""
     csv_inconsistent_cells = {}
-    for row_idx, row in df.iterrows():
-        for base, cols in base_to_cols.items():
-            values = [safe_str(row[col]).strip() for col in cols]
-            unique_vals = set(values)
-            if len(unique_vals) > 1:
+    for base, cols in base_to_cols.items():
+        if not cols:
+            continue
+        # One vectorized comparison per base instead of a Python loop per row
+        values = pd.DataFrame({col: column_strings(df[col]).str.strip() for col in cols}, index=df.index)
+        first = values[cols[0]]
+        same = values.eq(first, axis=0).all(axis=1)
+        kinds = [
+            ('csvunmatch', df.index[~same.to_numpy()]),
+            ('csvmatch', df.index[(same & (first != "")).to_numpy()]),
+        ]
+        for kind, rows in kinds:
+            for row_idx in rows:
                 for col in cols:
-                    for v in unique_vals:
-                        if values[cols.index(col)] != v:
-                            csv_inconsistent_cells[(row_idx, col)] = 'csvunmatch'
-            elif len(unique_vals) == 1 and list(unique_vals)[0] != "":
-                for col in cols:
-                    csv_inconsistent_cells[(row_idx, col)] = 'csvmatch'
+                    csv_inconsistent_cells[(row_idx, col)] = kind
     return csv_inconsistent_cells
 
 def validate_cell(
@@ -245,31 +233,162 @@ def validate_cell(
     # Unvalidated columns
     return "unvalidated"
 
-def style_dataframe(df):
+# --- Compiled rule table ---
+# Per-frame alternative to calling validate_cell for every cell: the rules in
+# validation_rules.yaml are compiled into vectorized column checks, row-level
+# inputs (TX TYPE class, parsed OVERRIDE ID, ...) are derived once per frame,
+# and every column is bound to a single check up front.
+
+def compile_rule_table(columns, schema=None, rules=None):
+    """Maps every column to its compiled check (None for unvalidated columns)."""
+    rules = rules or load_rules()
+    return {col: rules.rule_for(col, schema) for col in columns}
+
+def _csv_overrides(csv_inconsistent_cells, positions):
+    csv_overrides = defaultdict(list)
+    for (row_idx, col), kind in csv_inconsistent_cells.items():
+        if row_idx in positions:
+            csv_overrides[col].append((positions[row_idx], 'csvred' if kind == 'csvunmatch' else 'csvgreen'))
+    return csv_overrides
+
+def _column_statuses(df, col, rule, ctx, duplicate_positions, csv_overrides):
+    if rule is None:
+        result = ["unvalidated"] * len(df)
+    else:
+        result = rule(column_strings(df[col]), ctx).tolist()
+    # CSV consistency outranks duplicates, which outrank the column rule.
+    for i in duplicate_positions:
+        result[i] = "duplicate"
+    for i, status in csv_overrides.get(col, ()):
+        result[i] = status
+    return result
+
+def validate_frame(
+    df,
+    csv_inconsistent_cells=None,
+    duplicate_rows=None,
+    schema=None,
+    columns=None,
+    rules=None
+):
+    """Returns {col: [status per row]} with the statuses validate_cell produces.
+
+    Without a ``schema`` only the Excel column rules apply.
+    """
+    if csv_inconsistent_cells is None:
+        csv_inconsistent_cells = {}
+    if duplicate_rows is None:
+        duplicate_rows = set()
+    columns = list(df.columns) if columns is None else columns
+
+    rules = rules or load_rules()
+    ctx = rules.context(df)
+    table = compile_rule_table(columns, schema, rules)
+    positions = {row_idx: i for i, row_idx in enumerate(df.index)}
+    duplicate_positions = [positions[row_idx] for row_idx in duplicate_rows if row_idx in positions]
+    csv_overrides = _csv_overrides(csv_inconsistent_cells, positions)
+    return {
+        col: _column_statuses(df, col, table[col], ctx, duplicate_positions, csv_overrides)
+        for col in columns
+    }
+
+class FrameValidator:
+    """Validates columns of one frame on demand.
+
+    Duplicate rows and CSV consistency always come from the whole frame, so a
+    column gets the same status whether it is styled alone or with the rest.
+    Per-column results are memoized (least recently used evicted first) and
+    dropped when the validation rules are reloaded. Safe to share between
+    sessions: lookups are serialized on a lock.
+    """
+
+    def __init__(self, df, schema=None, max_cached_columns=128):
+        self.df = df
+        self.schema = schema or ColumnSchema.infer(df.columns)
+        self.max_cached_columns = max_cached_columns
+        self.duplicate_rows = find_duplicate_rows(df)
+        self._positions = {row_idx: i for i, row_idx in enumerate(df.index)}
+        self._duplicate_positions = [self._positions[row_idx] for row_idx in self.duplicate_rows]
+        self._csv_overrides = {}
+        self._statuses = OrderedDict()
+        self._rules = None
+        self._ctx = None
+        self._lock = threading.RLock()
+
+    def _current_rules(self):
+        rules = load_rules()
+        if rules is not self._rules:
+            self._rules = rules
+            # Built on first use: primed columns never need it
+            self._ctx = None
+            self._statuses.clear()
+        return rules
+
+    def _overrides_for(self, col):
+        if not self.schema.is_csv(col):
+            return {}
+        base = self.schema.base_of(col)
+        if base not in self._csv_overrides:
+            cells = build_csv_inconsistent_cells(self.df, {base: self.schema.base_to_cols[base]})
+            self._csv_overrides[base] = _csv_overrides(cells, self._positions)
+        return self._csv_overrides[base]
+
+    def column_status(self, col):
+        with self._lock:
+            rules = self._current_rules()
+            if col in self._statuses:
+                self._statuses.move_to_end(col)
+                return self._statuses[col]
+            rule = rules.rule_for(col, self.schema)
+            if self._ctx is None:
+                self._ctx = rules.context(self.df)
+            result = _column_statuses(
+                self.df, col, rule, self._ctx, self._duplicate_positions, self._overrides_for(col)
+            )
+            self._remember(col, result)
+            return result
+
+    def _remember(self, col, result):
+        self._statuses[col] = result
+        if len(self._statuses) > self.max_cached_columns:
+            self._statuses.popitem(last=False)
+
+    def prime(self, statuses):
+        """Caches statuses computed elsewhere, e.g. reused from a previous run."""
+        with self._lock:
+            self._current_rules()
+            for col, result in statuses.items():
+                self._remember(col, result)
+
+    def statuses(self, columns=None):
+        columns = list(self.df.columns) if columns is None else columns
+        with self._lock:
+            return {col: self.column_status(col) for col in columns}
+
+    def style(self, columns=None):
+        """Styler for ``df[columns]`` coloured with full-frame validation."""
+        columns = list(self.df.columns) if columns is None else list(columns)
+        return _style_from_statuses(self.df[columns], self.statuses(columns))
+
+STATUS_STYLES = {
+    "duplicate": "background-color: #cce6ff",  # blue for duplicate row
+    "csvred": "background-color: #b32400; color: #fff",  # dark red for csv mismatch
+    "csvgreen": "background-color: #a5f5a6",  # different green for csv match
+    True: "background-color: #d9f9d9",  # green
+    False: "background-color: #b32400; color: #fff",  # dark red
+    "unvalidated": "background-color: #fffbe6",  # light yellow
+}
+
+def _style_from_statuses(df, statuses):
+    css = pd.DataFrame(
+        {col: [STATUS_STYLES.get(status, "") for status in col_statuses] for col, col_statuses in statuses.items()},
+        index=df.index,
+    )
+    return df.style.apply(lambda _: css, axis=None)
+
+def style_dataframe(df, schema=None):
+    schema = schema or ColumnSchema.infer(df.columns)
     duplicate_rows = find_duplicate_rows(df)
-    base_to_cols, dynamic_suffixes = get_dynamic_csv_bases_and_suffixes(df)
-    csv_inconsistent_cells = build_csv_inconsistent_cells(df, base_to_cols)
-
-    def style_func(row):
-        columns = list(row.index)
-        style = []
-        row_idx = row.name
-        for i, col in enumerate(columns):
-            val = row.get(col, "")
-            valid = validate_cell(col, val, row, row_idx, csv_inconsistent_cells, duplicate_rows, dynamic_suffixes)
-            if valid == "duplicate":
-                style.append("background-color: #cce6ff")  # blue for duplicate row
-            elif valid == "csvred":
-                style.append("background-color: #b32400; color: #fff")  # dark red for csv mismatch
-            elif valid == "csvgreen":
-                style.append("background-color: #a5f5a6")  # different green for csv match
-            elif valid is True:
-                style.append("background-color: #d9f9d9")  # green
-            elif valid is False:
-                style.append("background-color: #b32400; color: #fff")  # dark red
-            elif valid == "unvalidated":
-                style.append("background-color: #fffbe6")  # light yellow
-            else:
-                style.append("")  # default
-        return style
-    return df.style.apply(style_func, axis=1)
+    csv_inconsistent_cells = build_csv_inconsistent_cells(df, schema.base_to_cols)
+    statuses = validate_frame(df, csv_inconsistent_cells, duplicate_rows, schema)
+    return _style_from_statuses(df, statuses)
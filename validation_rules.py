@@ -0,0 +1,246 @@
+import os
+import json
+import hashlib
+import yaml
+import numpy as np
+import pandas as pd
+
+RULES_PATH = os.environ.get(
+    "VALIDATION_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "validation_rules.yaml"),
+)
+
+HDR_OVERRIDE = 1
+SDR_OVERRIDE = 2
+
+class RuleConfigError(ValueError):
+    pass
+
+def parse_override_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def safe_str(val):
+    if val is None:
+        return ""
+    if isinstance(val, float) and pd.isna(val):
+        return ""
+    return str(val)
+
+def column_strings(series):
+    return series.map(safe_str)
+
+class RowContext:
+    """Per-row inputs shared by every column check, derived once per frame."""
+
+    def __init__(self, df, rules):
+        self.df = df
+        self.size = len(df)
+        self._fields = {}
+        tx_types = self.field('TX TYPE')
+        self.is_hdr = tx_types.isin(rules.hdr_tx_types).to_numpy()
+        self.is_sdr = tx_types.isin(rules.sdr_tx_types).to_numpy()
+        self.override_flags = rules.override_flags(self.field('OVERRIDE ID'))
+
+    def field(self, name):
+        """Stripped string values of an Excel field ("" when the column is absent)."""
+        if name not in self._fields:
+            if name in self.df.columns:
+                values = column_strings(self.df[name]).str.strip()
+            else:
+                values = pd.Series([""] * self.size, index=self.df.index, dtype=object)
+            self._fields[name] = values
+        return self._fields[name]
+
+class CompiledRules:
+    def __init__(self, config):
+        # Kept so worker processes can compile the exact same rules
+        self.config = config
+        # Identifies the rule set, so results validated under other rules are never reused
+        self.fingerprint = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+        tx_types = config.get("tx_types", {})
+        self.hdr_tx_types = list(tx_types.get("hdr", []))
+        self.sdr_tx_types = list(tx_types.get("sdr", []))
+        self.override_bitmap = _build_override_bitmap(config.get("override_ids", {}))
+        self.excel_rules = {
+            col: _compile_rule(col, spec) for col, spec in (config.get("excel_rules") or {}).items()
+        }
+        self.csv_rules = {
+            base: _compile_rule(base, spec) for base, spec in (config.get("csv_rules") or {}).items()
+        }
+
+    def override_flags(self, override_ids):
+        limit = len(self.override_bitmap)
+        positions = np.fromiter(
+            (
+                val if val is not None and 0 <= val < limit else -1
+                for val in map(parse_override_id, override_ids)
+            ),
+            dtype=np.int64,
+            count=len(override_ids),
+        )
+        return np.where(positions >= 0, self.override_bitmap[positions.clip(0)], 0)
+
+    def context(self, df):
+        return RowContext(df, self)
+
+    def rule_for(self, col, schema=None):
+        """The compiled check for a column, or None when the column is unvalidated.
+
+        CSV rules need ``schema`` (a ColumnSchema) to know a column's base field.
+        """
+        rule = self.excel_rules.get(col)
+        if rule is not None:
+            return rule
+        info = schema.info(col) if schema is not None else None
+        if info is not None and info.source == "csv":
+            return self.csv_rules.get(info.base)
+        return None
+
+def _build_override_bitmap(override_config):
+    size = 1
+    entries = []
+    for flag, key in ((HDR_OVERRIDE, "hdr"), (SDR_OVERRIDE, "sdr")):
+        spec = override_config.get(key) or {}
+        for start, end in spec.get("ranges", []):
+            entries.append((flag, int(start), int(end), None))
+        for pattern in spec.get("patterns", []):
+            entries.append((flag, int(pattern["min"]), int(pattern["max"]), int(pattern["hundreds_digit"])))
+    for _, start, end, _ in entries:
+        size = max(size, end + 1)
+    bitmap = np.zeros(size, dtype=np.uint8)
+    ids = np.arange(size)
+    for flag, start, end, hundreds_digit in entries:
+        mask = (ids >= start) & (ids <= end)
+        if hundreds_digit is not None:
+            mask &= (ids // 100) % 10 == hundreds_digit
+        bitmap[mask] |= flag
+    return bitmap
+
+def _compile_rule(name, spec):
+    if not isinstance(spec, dict) or "check" not in spec:
+        raise RuleConfigError(f"Rule {name!r} needs a 'check' predicate")
+    strip = bool(spec.get("strip", False))
+    ignore_case = bool(spec.get("ignore_case", False))
+    blank_fields = list(spec.get("unvalidated_if_blank", []))
+    fail_on_conflict = bool(spec.get("fail_on_override_conflict", False))
+    check = _compile_predicate(name, spec["check"], ignore_case)
+
+    def rule(values, ctx):
+        if strip:
+            values = values.str.strip()
+        if ignore_case:
+            values = values.str.lower()
+        result = np.where(check(values, ctx), True, False).astype(object)
+        if blank_fields:
+            blank = np.zeros(ctx.size, dtype=bool)
+            for field in blank_fields:
+                source = values if field == "value" else ctx.field(field)
+                blank |= (source == "").to_numpy()
+            result[blank] = "unvalidated"
+        if fail_on_conflict:
+            conflict = (
+                ((ctx.override_flags & SDR_OVERRIDE) > 0) & ctx.is_hdr |
+                ((ctx.override_flags & HDR_OVERRIDE) > 0) & ctx.is_sdr
+            )
+            result[conflict] = False
+        return result
+    return rule
+
+def _literal(value, ignore_case):
+    value = "" if value is None else str(value)
+    return value.lower() if ignore_case else value
+
+def _compile_predicate(name, spec, ignore_case):
+    """Turns one predicate node into fn(values, ctx) -> boolean ndarray."""
+    if isinstance(spec, bool):
+        return lambda values, ctx: np.full(ctx.size, spec)
+    if not isinstance(spec, dict):
+        raise RuleConfigError(f"Rule {name!r}: cannot read predicate {spec!r}")
+
+    if "equals" in spec:
+        literal = _literal(spec["equals"], ignore_case)
+        return lambda values, ctx: (values == literal).to_numpy()
+    if "in" in spec:
+        literals = [_literal(v, ignore_case) for v in spec["in"]]
+        return lambda values, ctx: values.isin(literals).to_numpy()
+    if "contains" in spec:
+        literal = _literal(spec["contains"], ignore_case)
+        return lambda values, ctx: values.str.contains(literal, regex=False).to_numpy(dtype=bool)
+    if "not_contains" in spec:
+        literal = _literal(spec["not_contains"], ignore_case)
+        return lambda values, ctx: ~values.str.contains(literal, regex=False).to_numpy(dtype=bool)
+    if "equals_field" in spec:
+        field = spec["equals_field"]
+        prefix = spec.get("prefix")
+
+        def equals_field(values, ctx):
+            expected = ctx.field(field)
+            if prefix is not None:
+                expected = expected.str[:int(prefix)]
+            if ignore_case:
+                expected = expected.str.lower()
+            return (values == expected).to_numpy()
+        return equals_field
+    if "equals_number_in" in spec:
+        field = spec["equals_number_in"]
+
+        def equals_number_in(values, ctx):
+            expected = ctx.field(field).str.extract(r'(\d+)', expand=False)
+            return (expected.notna() & (values == expected)).to_numpy()
+        return equals_number_in
+    if "override_id_in" in spec:
+        flag = {"hdr": HDR_OVERRIDE, "sdr": SDR_OVERRIDE}.get(spec["override_id_in"])
+        if flag is None:
+            raise RuleConfigError(f"Rule {name!r}: override_id_in must be 'hdr' or 'sdr'")
+        return lambda values, ctx: (ctx.override_flags & flag) > 0
+    if "all" in spec or "any" in spec:
+        combine = np.logical_and if "all" in spec else np.logical_or
+        parts = [_compile_predicate(name, p, ignore_case) for p in spec.get("all", spec.get("any"))]
+
+        def combined(values, ctx):
+            return combine.reduce([part(values, ctx) for part in parts])
+        return combined
+    if "by_tx_type" in spec:
+        branches = spec["by_tx_type"]
+        hdr = _compile_predicate(name, branches.get("hdr", False), ignore_case)
+        sdr = _compile_predicate(name, branches.get("sdr", False), ignore_case)
+        other = _compile_predicate(name, branches.get("other", False), ignore_case)
+
+        def by_tx_type(values, ctx):
+            return np.where(
+                ctx.is_hdr, hdr(values, ctx),
+                np.where(ctx.is_sdr, sdr(values, ctx), other(values, ctx)),
+            )
+        return by_tx_type
+    raise RuleConfigError(f"Rule {name!r}: unknown predicate {next(iter(spec))!r}")
+
+def _read_config(path):
+    with open(path, "r") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return yaml.safe_load(f)
+
+_cache = {}
+
+def load_rules(path=RULES_PATH):
+    """Compiled rules for ``path``, recompiled only when the file's mtime changes.
+
+    A file that fails to parse or compile keeps the last good rules active.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        rules = CompiledRules(_read_config(path))
+    except Exception as e:
+        if cached:
+            print(f"Error reloading validation rules from {path}, keeping previous rules:", e)
+            _cache[path] = (mtime, cached[1])
+            return cached[1]
+        raise
+    _cache[path] = (mtime, rules)
+    return rules
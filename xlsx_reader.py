@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import python_calamine  # optional, much faster Rust-based xlsx parser
+except ImportError:
+    python_calamine = None
+
+# Strings pd.read_excel treats as missing by default (pandas' STR_NA_VALUES).
+DEFAULT_NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+def _convert_cell(value):
+    # Same conversions as pandas' openpyxl reader followed by dtype=str.
+    if value is None:
+        return np.nan
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        as_int = int(value) if value.is_integer() else None
+        return str(as_int if as_int is not None else value)
+    value = str(value)
+    return np.nan if value in DEFAULT_NA_VALUES else value
+
+def _header_names(header):
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or name == "" else name
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _read_openpyxl_streaming(excel_file, columns):
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        names = _header_names(header)
+        wanted = [i for i, name in enumerate(names) if columns is None or name in columns]
+        data = {i: [] for i in wanted}
+        pending_blank_rows = 0
+        for row in rows:
+            # read_excel drops trailing empty rows but keeps empty rows in between
+            if all(v is None or v == "" for v in row):
+                pending_blank_rows += 1
+                continue
+            for i in wanted:
+                data[i].extend([np.nan] * pending_blank_rows)
+            pending_blank_rows = 0
+            for i in wanted:
+                data[i].append(_convert_cell(row[i]) if i < len(row) else np.nan)
+        return pd.DataFrame({names[i]: pd.Series(data[i], dtype=object) for i in wanted})
+    finally:
+        wb.close()
+
+def _read_calamine(excel_file, columns):
+    usecols = None if columns is None else (lambda name: name in columns)
+    return pd.read_excel(excel_file, engine="calamine", dtype=str, usecols=usecols)
+
+def read_xlsx(excel_file, columns=None):
+    """Reads the first sheet as strings, like ``pd.read_excel(excel_file, dtype=str)``.
+
+    Only ``columns`` (all when None) are materialized; absent ones are skipped.
+    Uses python-calamine when installed, otherwise openpyxl in read-only mode,
+    which streams rows instead of building the whole workbook in memory.
+    """
+    columns = None if columns is None else set(columns)
+    if python_calamine is not None:
+        return _read_calamine(excel_file, columns)
+    return _read_openpyxl_streaming(excel_file, columns)